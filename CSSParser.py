@@ -1,12 +1,34 @@
+import re
 
 from Selectors import DescendantSelector, TagSelector
 from Types import Element
 
 
 class CSSParser:
-    def __init__(self, s):
+    # Same character classes as word() and whitespace(): [^\W_] is
+    # exactly str.isalnum(), and \s is str.isspace()
+    WORD = re.compile(r"(?:[^\W_]|[#\-.%])+")
+    WHITESPACE = re.compile(r"\s*")
+    BODY_STOP = re.compile(r"[;}]")
+
+    # Whole well-formed "prop: value;" and "tag tag {" runs in one match.
+    # These use the much faster [\w#\-.%] class, which also allows "_",
+    # so a match containing "_" is discarded and parsed step by step.
+    FAST_WORD = r"[\w#\-.%]+"
+    DECLARATION = re.compile(
+        r"({0})\s*:\s*({0})\s*;\s*".format(FAST_WORD))
+    DECLARATIONS = re.compile(
+        r"(?:{0}\s*:\s*{0}\s*;\s*)*".format(FAST_WORD))
+    SELECTOR = re.compile(
+        r"({0}(?:\s+{0})*)\s*\{{\s*".format(FAST_WORD))
+    RULE = re.compile(
+        r"{}({})\}}".format(SELECTOR.pattern, DECLARATIONS.pattern))
+
+    def __init__(self, s, engine="fast"):
+        assert engine in ["fast", "legacy"]
         self.s = s
         self.i = 0
+        self.engine = engine
     
     def word(self):
         start = self.i
@@ -35,8 +57,50 @@ class CSSParser:
         self.whitespace()
         val = self.word()
         return prop.casefold(), val
-    
+
     def body(self):
+        if self.engine == "legacy":
+            return self.body_legacy()
+        s, n = self.s, len(self.s)
+        word, whitespace = self.WORD.match, self.WHITESPACE.match
+        declaration = self.DECLARATION.match
+        pairs = {}
+        i = self.i
+        m = self.DECLARATIONS.match(s, i)
+        if m.end() > i and "_" not in m.group():
+            pairs.update(self.make_body(m.group()))
+            i = m.end()
+        while i < n:
+            m = declaration(s, i)
+            if m and "_" not in m.group():
+                pairs[m.group(1).casefold()] = m.group(2)
+                i = m.end()
+                continue
+            # Each step either advances i or leaves it where parsing failed,
+            # which is where body_legacy would start ignore_until() from
+            m = word(s, i)
+            if m:
+                prop = m.group()
+                i = whitespace(s, m.end()).end()
+                if i < n and s[i] == ":":
+                    i = whitespace(s, i + 1).end()
+                    m = word(s, i)
+                    if m:
+                        pairs[prop.casefold()] = m.group()
+                        i = whitespace(s, m.end()).end()
+                        if i < n and s[i] == ";":
+                            i = whitespace(s, i + 1).end()
+                            continue
+            m = self.BODY_STOP.search(s, i)
+            if m and m.group() == ";":
+                i = whitespace(s, m.end()).end()
+            else:
+                i = m.start() if m else n
+                break
+        self.i = i
+        return pairs
+
+    def body_legacy(self):
         pairs = {}
         while self.i < len(self.s):
             try:
@@ -73,8 +137,84 @@ class CSSParser:
             out = DescendantSelector(out, descendant)
             self.whitespace()
         return out
-    
+
+    def match_selector(self, i):
+        # Returns (selector, i), or (None, i) with i where parsing failed
+        s, n = self.s, len(self.s)
+        word, whitespace = self.WORD.match, self.WHITESPACE.match
+        m = word(s, i)
+        if not m: return None, i
+        out = TagSelector(m.group().casefold())
+        i = whitespace(s, m.end()).end()
+        while i < n and s[i] != "{":
+            m = word(s, i)
+            if not m: return None, i
+            out = DescendantSelector(out, TagSelector(m.group().casefold()))
+            i = whitespace(s, m.end()).end()
+        return out, i
+
+    def make_selector(self, text):
+        tags = text.split()
+        out = TagSelector(tags[0].casefold())
+        for tag in tags[1:]:
+            out = DescendantSelector(out, TagSelector(tag.casefold()))
+        return out
+
+    def make_body(self, text):
+        pairs = {}
+        for prop, val in self.DECLARATION.findall(text):
+            pairs[prop.casefold()] = val
+        return pairs
+
     def parse(self):
+        if self.engine == "legacy":
+            return self.parse_legacy()
+        s, n = self.s, len(self.s)
+        whitespace = self.WHITESPACE.match
+        rules = []
+        i = self.i
+        while i < n:
+            i = whitespace(s, i).end()
+            m = self.RULE.match(s, i)
+            if m and "_" not in m.group():
+                rules.append((self.make_selector(m.group(1)),
+                              self.make_body(m.group(2))))
+                i = m.end()
+                continue
+            m = self.SELECTOR.match(s, i)
+            if m and "_" not in m.group():
+                selector = self.make_selector(m.group(1))
+                self.i = m.end()
+                body = self.body()
+                i = self.i
+                if i < n and s[i] == "}":
+                    i += 1
+                    rules.append((selector, body))
+                    continue
+                end = s.find("}", i)
+                if end == -1:
+                    i = n
+                    break
+                i = whitespace(s, end + 1).end()
+                continue
+            selector, i = self.match_selector(i)
+            if selector is not None and i < n and s[i] == "{":
+                self.i = whitespace(s, i + 1).end()
+                body = self.body()
+                i = self.i
+                if i < n and s[i] == "}":
+                    i += 1
+                    rules.append((selector, body))
+                    continue
+            end = s.find("}", i)
+            if end == -1:
+                i = n
+                break
+            i = whitespace(s, end + 1).end()
+        self.i = i
+        return rules
+
+    def parse_legacy(self):
         rules = []
         while self.i < len(self.s):
             try:
@@ -82,7 +222,7 @@ class CSSParser:
                 selector = self.selector()
                 self.literal("{")
                 self.whitespace()
-                body = self.body()
+                body = self.body_legacy()
                 self.literal("}")
                 rules.append((selector, body))
             
@@ -95,4 +235,3 @@ class CSSParser:
                     break
         return rules
 
-
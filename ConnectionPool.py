@@ -0,0 +1,114 @@
+import socket
+import ssl
+import threading
+import time
+
+
+class Connection:
+    def __init__(self, key, sock):
+        self.key = key
+        self.sock = sock
+        self.file = sock.makefile("rb")
+        self.last_used = time.monotonic()
+        self.reused = False
+
+    def close(self):
+        try:
+            self.file.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+class ConnectionPool:
+    # Idle keep-alive sockets keyed by (scheme, host, port), shared by all
+    # URL objects in the process. Sockets idle for longer than
+    # idle_timeout are closed instead of reused; the default stays under
+    # the 5s keep-alive timeout common servers (Apache, Node) use.
+    def __init__(self, idle_timeout=4.0, max_idle_per_host=6):
+        self.idle_timeout = idle_timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.ssl_context = None
+        self.hits = 0
+        self.misses = 0
+
+    def get_ssl_context(self):
+        # One context for every TLS connection, created on first use
+        with self.lock:
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            return self.ssl_context
+
+    def acquire(self, scheme, host, port, fresh=False):
+        # fresh=True always opens a new socket, e.g. to retry after an idle
+        # one turned out to be closed by the server
+        key = (scheme, host, port)
+        now = time.monotonic()
+        expired = []
+        conn = None
+        with self.lock:
+            idle = [] if fresh else self.idle.get(key, [])
+            while idle:
+                candidate = idle.pop()
+                if now - candidate.last_used > self.idle_timeout:
+                    expired.append(candidate)
+                else:
+                    conn = candidate
+                    break
+            if conn:
+                self.hits += 1
+            else:
+                self.misses += 1
+        for candidate in expired:
+            candidate.close()
+        if conn:
+            conn.reused = True
+            return conn
+
+        sock = socket.create_connection((host, port))
+        if scheme == "https":
+            sock = self.get_ssl_context().wrap_socket(
+                sock, server_hostname=host)
+        return Connection(key, sock)
+
+    def release(self, conn, reusable):
+        # Hand a connection back once its response has been fully read
+        if not reusable:
+            conn.close()
+            return
+        conn.last_used = time.monotonic()
+        with self.lock:
+            idle = self.idle.setdefault(conn.key, [])
+            idle.append(conn)
+            if len(idle) > self.max_idle_per_host:
+                extra = idle.pop(0)
+            else:
+                extra = None
+        if extra:
+            extra.close()
+
+    def discard_idle(self, scheme, host, port):
+        # Closes every idle socket to one server, once one of them was
+        # found dead: the others were left idle as long and likely are too
+        with self.lock:
+            conns = self.idle.pop((scheme, host, port), [])
+        for conn in conns:
+            conn.close()
+
+    def close_all(self):
+        with self.lock:
+            conns = [conn for idle in self.idle.values() for conn in idle]
+            self.idle = {}
+        for conn in conns:
+            conn.close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "idle": sum(len(idle) for idle in self.idle.values()),
+            }
+
+POOL = ConnectionPool()
@@ -1,14 +1,18 @@
 class DrawText:
-    def __init__(self, x1, y1, text, font, color):
+    # `text` may be a run of several words. The layout can pass the font's
+    # linespace so building one doesn't query the font.
+    def __init__(self, x1, y1, text, font, color, linespace=None):
         self.top = y1
         self.left = x1
         self.text = text
         self.font = font
-        self.bottom = y1 + font.metrics("linespace")
+        if linespace is None:
+            linespace = font.metrics("linespace")
+        self.bottom = y1 + linespace
         self.color= color
 
     def execute(self, scroll, canvas):
-        canvas.create_text(
+        return canvas.create_text(
             self.left, self.top - scroll,
             text=self.text,
             font=self.font,
@@ -24,8 +28,93 @@ class DrawRect:
         self.color = color
     
     def execute(self, scroll, canvas):
-        canvas.create_rectangle(
+        return canvas.create_rectangle(
             self.left, self.top - scroll,
             self.right, self.bottom - scroll,
             width=0,
-            fill=self.color)
\ No newline at end of file
+            fill=self.color)
+
+class DisplayList:
+    # Draw commands bucketed by y so a scroll position only touches the
+    # commands in view. Commands taller than TALL_BUCKETS buckets (page
+    # backgrounds and the like) are few, so they're just scanned.
+    BUCKET_SIZE = 256
+    TALL_BUCKETS = 8
+
+    def __init__(self, cmds, bucket_size=BUCKET_SIZE):
+        self.cmds = list(cmds)
+        self.bucket_size = bucket_size
+        self.buckets = {}
+        self.tall = []
+        for index, cmd in enumerate(self.cmds):
+            first = int(cmd.top // bucket_size)
+            last = int(cmd.bottom // bucket_size)
+            if last - first >= self.TALL_BUCKETS:
+                self.tall.append(index)
+                continue
+            for bucket in range(first, last + 1):
+                self.buckets.setdefault(bucket, []).append(index)
+
+    def visible(self, top, bottom):
+        # Commands overlapping [top, bottom], in paint order
+        indices = set(self.tall)
+        for bucket in range(int(top // self.bucket_size),
+                            int(bottom // self.bucket_size) + 1):
+            indices.update(self.buckets.get(bucket, ()))
+        cmds = self.cmds
+        return [cmds[i] for i in sorted(indices)
+                if cmds[i].top <= bottom and cmds[i].bottom >= top]
+
+    def execute(self, scroll, canvas, height):
+        for cmd in self.visible(scroll, scroll + height):
+            cmd.execute(scroll, canvas)
+
+    def __iter__(self):
+        return iter(self.cmds)
+
+    def __len__(self):
+        return len(self.cmds)
+
+class RetainedRenderer:
+    # Keeps the canvas items created by draw commands. Scrolling moves all
+    # of them with one canvas.move and only creates items for commands
+    # that come into range; items that fall out of range are deleted.
+    # `margin` pixels above and below the viewport are kept drawn so
+    # short scrolls don't create anything.
+    TAG = "page"
+
+    def __init__(self, canvas, height, margin=None):
+        self.canvas = canvas
+        self.height = height
+        self.margin = height if margin is None else margin
+        self.display_list = DisplayList([])
+        self.items = {}  # Draw command -> canvas item id
+        self.scroll = 0
+
+    def set_display_list(self, display_list):
+        self.clear()
+        if not isinstance(display_list, DisplayList):
+            display_list = DisplayList(display_list)
+        self.display_list = display_list
+
+    def clear(self):
+        self.canvas.delete(self.TAG)
+        self.items = {}
+
+    def draw(self, scroll):
+        if self.items and scroll != self.scroll:
+            self.canvas.move(self.TAG, 0, self.scroll - scroll)
+        self.scroll = scroll
+
+        wanted = self.display_list.visible(scroll - self.margin,
+                                           scroll + self.height + self.margin)
+        items = {}
+        for cmd in wanted:
+            item = self.items.pop(cmd, None)
+            if item is None:
+                item = cmd.execute(scroll, self.canvas)
+                self.canvas.addtag_withtag(self.TAG, item)
+            items[cmd] = item
+        for item in self.items.values():
+            self.canvas.delete(item)
+        self.items = items
@@ -0,0 +1,181 @@
+import collections
+import os
+import unicodedata
+
+from Globals import FONT_METRICS, FONTS
+from Trace import TRACER
+
+
+MEASURE_CACHE_SIZE = 65536
+
+# Advance widths in 1/1000 em for printable ASCII (Helvetica/Arial
+# metrics), used by the headless backend
+GLYPH_WIDTHS = dict(zip(
+    " !\"#$%&'()*+,-./0123456789:;<=>?@"
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZ[\\]^_`"
+    "abcdefghijklmnopqrstuvwxyz{|}~", [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333,
+    278, 278, 556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278,
+    584, 584, 584, 556, 1015,
+    667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722,
+    778, 667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278,
+    278, 469, 556, 333,
+    556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556,
+    556, 556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260,
+    334, 584,
+]))
+DEFAULT_GLYPH_WIDTH = 556
+WIDE_GLYPH_WIDTH = 1000
+BOLD_WIDTH_FACTOR = 1.06
+ASCENT, DESCENT = 0.905, 0.212  # In em, as in Liberation Sans/Arial
+PIXELS_PER_POINT = 96 / 72
+
+class TkBackend:
+    name = "tk"
+
+    def __init__(self):
+        import tkinter
+        import tkinter.font
+        self.tkinter = tkinter
+
+    def create_font(self, size, weight, style):
+        font = self.tkinter.font.Font(size=size, weight=weight,
+            slant=style)
+        label = self.tkinter.Label(font=font)
+        return font, label
+
+class HeadlessFont:
+    # Deterministic stand-in for a tkinter font: widths come from
+    # GLYPH_WIDTHS, so layout gives the same result on every machine
+    def __init__(self, size, weight, style):
+        self.size = size
+        self.weight = weight
+        self.style = style
+        self.em = size * PIXELS_PER_POINT
+        if weight == "bold":
+            self.em *= BOLD_WIDTH_FACTOR
+        ascent = round(size * PIXELS_PER_POINT * ASCENT)
+        descent = round(size * PIXELS_PER_POINT * DESCENT)
+        self.font_metrics = {"ascent": ascent, "descent": descent,
+                             "linespace": ascent + descent, "fixed": 0}
+
+    def measure(self, text):
+        total = 0
+        for c in text:
+            width = GLYPH_WIDTHS.get(c)
+            if width is None:
+                if unicodedata.east_asian_width(c) in ("W", "F"):
+                    width = WIDE_GLYPH_WIDTH
+                else:
+                    width = DEFAULT_GLYPH_WIDTH
+            total += width
+        return round(total * self.em / 1000)
+
+    def metrics(self, *options):
+        if options:
+            return self.font_metrics[options[0]]
+        return dict(self.font_metrics)
+
+    def __str__(self):
+        return "Helvetica {} {} {}".format(self.size, self.weight,
+                                           self.style)
+
+class HeadlessBackend:
+    name = "headless"
+
+    def create_font(self, size, weight, style):
+        return HeadlessFont(size, weight, style), None
+
+BACKENDS = {
+    "tk": TkBackend,
+    "headless": HeadlessBackend,
+}
+
+class MeasureCache:
+    # LRU of text widths keyed by (font key, text); each miss is a call
+    # into the backend (a Tk round trip for the Tk backend)
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def measure(self, font, text):
+        key = (font.key, text)
+        width = self.entries.get(key)
+        if width is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return width
+        self.misses += 1
+        width = font.native.measure(text)
+        self.entries[key] = width
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return width
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+MEASURES = MeasureCache(MEASURE_CACHE_SIZE)
+
+class Font:
+    # Wraps a backend font so measure() and metrics() hit the caches
+    # above. str() gives the native font name, so a Tk font can still be
+    # passed to the canvas.
+    def __init__(self, key, native):
+        self.key = key
+        self.native = native
+
+    def measure(self, text):
+        return MEASURES.measure(self, text)
+
+    def metrics(self, option=None):
+        metrics = FONT_METRICS.get(self.key)
+        if metrics is None:
+            metrics = FONT_METRICS[self.key] = self.native.metrics()
+        return metrics if option is None else metrics[option]
+
+    def __str__(self):
+        return str(self.native)
+
+backend = None
+
+def set_backend(name):
+    # Fonts from the old backend don't mix with the new one, so all the
+    # caches start over
+    global backend
+    backend = BACKENDS[name]()
+    FONTS.clear()
+    FONT_METRICS.clear()
+    MEASURES.clear()
+
+def get_backend():
+    if backend is None:
+        set_backend(os.environ.get("BROWSER_FONT_BACKEND", "tk"))
+    return backend
+
+def get_font(size, weight, style):
+    key = (size, weight, style)
+    if key not in FONTS:
+        native, keepalive = get_backend().create_font(size, weight, style)
+        FONTS[key] = (Font(key, native), keepalive)
+    return FONTS[key][0]
+
+def font_cache_info():
+    return {
+        "backend": get_backend().name,
+        "fonts": len(FONTS),
+        "measure_hits": MEASURES.hits,
+        "measure_misses": MEASURES.misses,
+        "measure_hit_rate": MEASURES.hit_rate(),
+        "measure_entries": len(MEASURES.entries),
+    }
+
+TRACER.add_sampler("fonts", font_cache_info)
@@ -1,10 +1,13 @@
-from CSSParser import CSSParser
+import os
+
+from StyleSheetCache import load_style_sheet
 
 
 WIDTH, HEIGHT = 800, 600
 SCROLL_STEP = 100
 HSTEP, VSTEP = 13, 18
 FONTS = {}
+FONT_METRICS = {}  # Font key -> tkinter metrics() dict, filled once per font
 BLOCK_ELEMENTS = [
     "html", "head", "body", "article", "section", "nav", "aside",
     "h1", "h2", "h3", "h4", "h5", "h6", "hgroup", "header",
@@ -13,11 +16,30 @@ BLOCK_ELEMENTS = [
     "figcaption", "main", "div", "table", "form", "fieldset",
     "legend", "details", "summary"
 ]
-DEFAULT_STYLE_SHEET = CSSParser(open("browser.css").read()).parse()  
+DEFAULT_STYLE_SHEET_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "browser.css")
+CACHE_DIR = os.environ.get(
+    "BROWSER_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "browser"))
+STYLE_SHEETS = {}
 
 INHERITED_PROPERTIES = {
     "font-size": "16px",
     "font-style": "normal",
     "font-weight": "normal",
     "color": "black",
-}
\ No newline at end of file
+}
+
+def default_style_sheet():
+    # Loaded on first use rather than at import time
+    if DEFAULT_STYLE_SHEET_PATH not in STYLE_SHEETS:
+        STYLE_SHEETS[DEFAULT_STYLE_SHEET_PATH] = load_style_sheet(
+            DEFAULT_STYLE_SHEET_PATH, CACHE_DIR)
+    return STYLE_SHEETS[DEFAULT_STYLE_SHEET_PATH]
+
+def __getattr__(name):
+    # Keeps `from Globals import DEFAULT_STYLE_SHEET` working, lazily
+    if name == "DEFAULT_STYLE_SHEET":
+        return default_style_sheet()
+    raise AttributeError("module {!r} has no attribute {!r}".format(
+        __name__, name))
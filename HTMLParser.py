@@ -1,25 +1,142 @@
+import re
+import sys
+
+from Trace import TRACER
 from Types import Element, Text
 
 
 class HTMLParser:
-    SELF_CLOSING_TAGS = [
-    "area", "base", "br", "col", "embed", "hr", "img", "input",
-    "link", "meta", "param", "source", "track", "wbr",
-    ]
+    SELF_CLOSING_TAGS = frozenset([
+        "area", "base", "br", "col", "embed", "hr", "img", "input",
+        "link", "meta", "param", "source", "track", "wbr",
+    ])
 
-    HEAD_TAGS = [
+    HEAD_TAGS = frozenset([
         "base", "basefont", "bgsound", "noscript",
         "link", "meta", "title", "style", "script",
-    ]
-    def __init__(self, body):
+    ])
+
+    # Tags that don't force an implicit <head>/<body> right inside <html>
+    HTML_CHILD_TAGS = frozenset(["head", "body", "/html"])
+
+    # Tags allowed to stay inside an open <head>
+    IN_HEAD_TAGS = HEAD_TAGS | {"/head"}
+
+    # Insertion modes, derived from the open element stack:
+    # [] / [html] / [html, head] / anything deeper
+    BEFORE_HTML, IN_HTML, IN_HEAD, IN_BODY = \
+        "before-html", "in-html", "in-head", "in-body"
+
+    DELIMITERS = re.compile(r"[<>]")
+
+    TEXT, START_TAG, END_TAG, COMMENT = "text", "start", "end", "comment"
+
+    def __init__(self, body="", engine="fast"):
+        assert engine in ["fast", "legacy"]
         self.body = body
+        self.engine = engine
         self.unfinished = []
+        self.mode = self.BEFORE_HTML
+        self.buffer = ""
+        self.in_tag = False
+        # Offsets into self.buffer already scanned by an earlier feed(), so
+        # a run of text or a comment spanning many chunks is scanned once
+        self.scan_start = 0
+        self.comment_scan_start = 0
 
     def parse(self):
+        with TRACER.span("parse", engine=self.engine, bytes=len(self.body)):
+            if self.engine == "legacy":
+                return self.parse_legacy()
+            self.feed(self.body)
+            return self.close()
+
+    def feed(self, chunk):
+        # Whatever can't be tokenized yet (a partial tag, text that may
+        # continue, an open comment) stays in self.buffer for the next chunk.
+        assert self.engine == "fast"
+        self.buffer += chunk
+        self.consume(final=False)
+
+    def close(self):
+        self.consume(final=True)
+        return self.finish()
+
+    def tree(self):
+        # The document parsed so far. Open elements are already attached to
+        # their parents, so this can be styled and laid out mid-stream.
+        return self.unfinished[0] if self.unfinished else None
+
+    def consume(self, final):
+        for kind, data in self.tokens(self.buffer, final):
+            if kind == self.TEXT:
+                self.add_text(data)
+            elif kind in (self.START_TAG, self.END_TAG):
+                self.add_tag(data)
+
+    def tokens(self, body, final=True):
+        # Same splitting rules as parse_legacy: text runs end at "<",
+        # tag text ends at ">", and "<!--" swallows everything up to "-->"
+        # (all of it, unlike parse_legacy, which leaves a "<->" element).
+        TEXT, START_TAG, END_TAG, COMMENT = \
+            self.TEXT, self.START_TAG, self.END_TAG, self.COMMENT
+        text_start = 0
+        in_tag = self.in_tag
+        scan_start, self.scan_start = self.scan_start, 0
+        comment_scan_start, self.comment_scan_start = self.comment_scan_start, 0
+        for m in self.DELIMITERS.finditer(body, scan_start):
+            pos = m.start()
+            if pos < text_start:
+                continue  # Inside a comment we already skipped
+            if m.group() == ">":
+                in_tag = False
+                tag = body[text_start:pos]
+                if tag[:1] == "/" or tag.lstrip()[:1] == "/":
+                    yield END_TAG, tag
+                else:
+                    yield START_TAG, tag
+            elif body.startswith("<!--", pos):
+                end = body.find("-->", max(pos + 2, comment_scan_start))
+                if end == -1 and not final:
+                    # Resume at this "<", and the "-->" search where it
+                    # stopped (a "--" at the end may be half of it)
+                    self.scan_start = pos - text_start
+                    self.comment_scan_start = len(body) - text_start - 2
+                    break
+                if pos > text_start:
+                    yield TEXT, body[text_start:pos]
+                if end == -1:
+                    yield COMMENT, body[pos + 4:]
+                    text_start = len(body)
+                    break
+                yield COMMENT, body[pos + 4:end]
+                text_start = end + 3
+                continue
+            elif not final and "<!--".startswith(body[pos:pos + 4]) \
+                 and pos + 4 > len(body):
+                self.scan_start = pos - text_start
+                break  # Might be a comment opener cut off by the chunk
+            else:
+                in_tag = True
+                if pos > text_start:
+                    yield TEXT, body[text_start:pos]
+            text_start = pos + 1
+        else:
+            if final and not in_tag and text_start < len(body):
+                yield TEXT, body[text_start:]
+                text_start = len(body)
+            self.scan_start = len(body) - text_start
+        self.in_tag = in_tag
+        self.buffer = body[text_start:]
+
+    def parse_legacy(self):
+        # The original character-at-a-time parser, kept as is to compare
+        # against. Its `i +=` skips do nothing inside enumerate, so the "->"
+        # of every "-->" comes through as a bogus "<->" element; the fast
+        # engine doesn't produce it.
         text = ""
         in_tag = False
         in_comment = False
-        # print(self.body)  
         for i, c in enumerate(self.body):
             if in_comment:
                 if c == '-' and self.body[i:i+3] == '-->':
@@ -57,6 +174,7 @@ class HTMLParser:
         parent = self.unfinished[-1]
         node = Text(text, parent)
         parent.children.append(node)
+        if TRACER.enabled: TRACER.count("parse.text_nodes")
 
     def add_tag(self, tag):
         tag, attributes = self.get_attributes(tag)
@@ -64,9 +182,8 @@ class HTMLParser:
         self.implicit_tags(tag)
         if tag.startswith("/"):
             if len(self.unfinished) == 1: return
-            node = self.unfinished.pop()
-            parent = self.unfinished[-1]
-            parent.children.append(node)
+            self.unfinished.pop()
+            self.update_mode()
         elif tag in self.SELF_CLOSING_TAGS:
             parent = self.unfinished[-1]
             node = Element(tag, attributes, parent)
@@ -74,46 +191,60 @@ class HTMLParser:
         else:
             parent = self.unfinished[-1] if self.unfinished else None
             node = Element(tag, attributes, parent)
+            if parent: parent.children.append(node)
             self.unfinished.append(node)
+            self.update_mode()
 
     def finish(self):
         if not self.unfinished:
             self.implicit_tags(None)
         while len(self.unfinished) > 1:
-            node = self.unfinished.pop()
-            parent = self.unfinished[-1]
-            parent.children.append(node)
-        return self.unfinished.pop()
+            self.unfinished.pop()
+        root = self.unfinished.pop()
+        self.update_mode()
+        return root
 
     def get_attributes(self, text):
         parts = text.split()
         tag = parts[0].casefold()
-        print(tag)
+        if TRACER.enabled:
+            TRACER.count("parse.tags")
+            TRACER.count("parse.attributes", len(parts) - 1)
         attributes = {}
         for attrpair in parts[1:]:
             if "=" in attrpair:
                 key, value = attrpair.split("=", 1)
-                print(key + "=" + value)
                 if len(value) > 2 and value[0] in ["'", "\""]:
                     value = value[1:-1]
-                attributes[key.casefold()] = value
+                attributes[sys.intern(key.casefold())] = value
             else:
-                attributes[attrpair.casefold()] = ""
+                attributes[sys.intern(attrpair.casefold())] = ""
         return tag, attributes
 
+    def update_mode(self):
+        # The root is always <html> (implicit_tags inserts it), so the mode
+        # only depends on the stack depth and the tag right below the root.
+        depth = len(self.unfinished)
+        if depth == 0:
+            self.mode = self.BEFORE_HTML
+        elif depth == 1:
+            self.mode = self.IN_HTML
+        elif depth == 2 and self.unfinished[1].tag == "head":
+            self.mode = self.IN_HEAD
+        else:
+            self.mode = self.IN_BODY
+
     def implicit_tags(self, tag):
         while True:
-            open_tags = [node.tag for node in self.unfinished]
-            if open_tags == [] and tag != "html":
+            mode = self.mode
+            if mode == self.BEFORE_HTML and tag != "html":
                 self.add_tag("html")
-            elif open_tags == ["html"] \
-                 and tag not in ["head", "body", "/html"]:
+            elif mode == self.IN_HTML and tag not in self.HTML_CHILD_TAGS:
                 if tag in self.HEAD_TAGS:
                     self.add_tag("head")
                 else:
                     self.add_tag("body")
-            elif open_tags == ["html", "head"] and \
-                 tag not in ["/head"] + self.HEAD_TAGS:
+            elif mode == self.IN_HEAD and tag not in self.IN_HEAD_TAGS:
                 self.add_tag("/head")
             else:
-                break
\ No newline at end of file
+                break
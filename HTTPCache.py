@@ -0,0 +1,213 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+
+from Globals import CACHE_DIR
+
+
+def parse_cache_control(value):
+    directives = {}
+    for part in value.split(","):
+        key, _, arg = part.strip().partition("=")
+        if key:
+            directives[key.casefold()] = arg.strip().strip('"')
+    return directives
+
+class HTTPCache:
+    # Response cache keyed by full URL. Recently used bodies stay in an
+    # in-memory LRU; every stored body is also written to
+    # <directory>/objects/<sha256> and listed in <directory>/index.json,
+    # so entries survive between runs. With directory=None nothing is
+    # written and entries last only as long as their body stays in memory.
+    def __init__(self, directory, memory_entries=64, disk_entries=2048):
+        self.directory = directory
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.memory = collections.OrderedDict()  # url -> body
+        self.index = None  # url -> metadata, loaded on first use
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.stale = 0
+        self.revalidations = 0
+        self.misses = 0
+
+    def index_path(self):
+        return os.path.join(self.directory, "index.json")
+
+    def object_path(self, digest):
+        return os.path.join(self.directory, "objects", digest)
+
+    def load_index(self):
+        if self.index is None and self.directory is None:
+            self.index = {}
+        if self.index is None:
+            try:
+                with open(self.index_path(), encoding="utf8") as f:
+                    self.index = json.load(f)
+            except (OSError, ValueError):
+                self.index = {}
+        return self.index
+
+    def save_index(self):
+        if self.directory is None:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = "{}.{}.tmp".format(self.index_path(), os.getpid())
+            with open(tmp, "w", encoding="utf8") as f:
+                json.dump(self.index, f)
+            os.replace(tmp, self.index_path())
+        except OSError:
+            pass
+
+    def lookup(self, url):
+        # Returns (metadata, body, is_fresh) or None
+        with self.lock:
+            meta = self.load_index().get(url)
+            if meta is None:
+                self.misses += 1
+                return None
+            body = self.memory.get(url)
+            if body is None and self.directory is None:
+                del self.index[url]
+                self.misses += 1
+                return None
+            if body is None:
+                try:
+                    with open(self.object_path(meta["hash"]), "rb") as f:
+                        body = f.read().decode("utf8")
+                except OSError:
+                    del self.index[url]
+                    self.misses += 1
+                    return None
+            self.remember(url, body)
+            fresh = self.is_fresh(meta)
+            if fresh:
+                self.hits += 1
+            else:
+                self.stale += 1
+            return meta, body, fresh
+
+    def metadata(self, url):
+        # The stored entry's metadata without loading the body or counting
+        # a lookup, e.g. to compare validators
+        with self.lock:
+            meta = self.load_index().get(url)
+            return dict(meta) if meta else None
+
+    def is_fresh(self, meta):
+        return time.time() - meta["stored_at"] < meta["max_age"]
+
+    def validators(self, meta):
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def store(self, url, headers, body):
+        directives = parse_cache_control(headers.get("cache-control", ""))
+        if "no-store" in directives:
+            self.remove(url)
+            return
+        max_age = 0
+        if "max-age" in directives and "no-cache" not in directives:
+            try:
+                max_age = int(directives["max-age"])
+            except ValueError:
+                pass
+        etag = headers.get("etag")
+        last_modified = headers.get("last-modified")
+        if max_age <= 0 and not etag and not last_modified:
+            # Could never be served or revalidated; an older copy of this
+            # URL is now out of date too
+            self.remove(url)
+            return
+        data = body.encode("utf8")
+        digest = hashlib.sha256(data).hexdigest()
+        if self.directory is not None:
+            path = self.object_path(digest)
+            try:
+                if not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    tmp = "{}.{}.tmp".format(path, os.getpid())
+                    with open(tmp, "wb") as f:
+                        f.write(data)
+                    os.replace(tmp, path)
+            except OSError:
+                return
+        with self.lock:
+            index = self.load_index()
+            index.pop(url, None)  # Re-insert so index order is store order
+            index[url] = {
+                "hash": digest,
+                "stored_at": time.time(),
+                "max_age": max_age,
+                "etag": etag,
+                "last_modified": last_modified,
+            }
+            self.remember(url, body)
+            self.evict()
+            self.save_index()
+
+    def refresh(self, url, headers):
+        # A 304 confirmed our copy; restart its freshness lifetime
+        with self.lock:
+            meta = self.load_index().get(url)
+            if meta is None: return
+            self.revalidations += 1
+            directives = parse_cache_control(headers.get("cache-control", ""))
+            if "max-age" in directives and "no-cache" not in directives:
+                try:
+                    meta["max_age"] = int(directives["max-age"])
+                except ValueError:
+                    pass
+            meta["etag"] = headers.get("etag", meta["etag"])
+            meta["last_modified"] = headers.get("last-modified",
+                                                meta["last_modified"])
+            meta["stored_at"] = time.time()
+            self.save_index()
+
+    def remove(self, url):
+        with self.lock:
+            self.memory.pop(url, None)
+            if self.load_index().pop(url, None) is not None:
+                self.save_index()
+
+    def remember(self, url, body):
+        self.memory[url] = body
+        self.memory.move_to_end(url)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def evict(self):
+        # Oldest entries go first; object files are shared by identical
+        # bodies, so only delete ones nothing else points to
+        index = self.index
+        while len(index) > self.disk_entries:
+            url = next(iter(index))
+            meta = index.pop(url)
+            self.memory.pop(url, None)
+            if self.directory is not None and \
+               not any(m["hash"] == meta["hash"] for m in index.values()):
+                try:
+                    os.remove(self.object_path(meta["hash"]))
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "stale": self.stale,
+                "revalidations": self.revalidations,
+                "misses": self.misses,
+                "memory_entries": len(self.memory),
+                "disk_entries": len(self.load_index()),
+            }
+
+HTTP_CACHE = HTTPCache(os.path.join(CACHE_DIR, "http"))
@@ -1,22 +1,57 @@
-import tkinter
+from array import array
+
 from Draw import DrawRect, DrawText
-from Globals import BLOCK_ELEMENTS, FONTS, HSTEP, VSTEP, WIDTH
+from Fonts import get_font
+from Globals import BLOCK_ELEMENTS, HSTEP, VSTEP, WIDTH
+from Trace import TRACER
 from Types import Element, Text
+from utils import tree_to_list
 
 class DocumentLayout:
-    def __init__(self, node):
+    def __init__(self, node, width=WIDTH):
         self.node = node
         self.parent = None
+        self.document = self
         self.children = []
+        self.viewport_width = width
+        self.child_needs_layout = False
+        self.recomputed = 0  # Blocks actually laid out by the last pass
+        self.fonts = IdTable()  # Shared by every block's LineBoxes
+        self.colors = IdTable()
 
     def layout(self):
-        child = BlockLayout(self.node, self, None)
-        self.children.append(child)
-        self.width = WIDTH - 2*HSTEP
+        # Only dirty blocks (and ones whose x/width changed) are laid out
+        # again; clean ones keep their boxes and are just moved if needed
+        self.recomputed = 0
+        if not self.children:
+            self.children.append(BlockLayout(self.node, self, None))
+        child = self.children[0]
+        self.width = self.viewport_width - 2*HSTEP
         self.x = HSTEP
         self.y = VSTEP
-        child.layout()
+        with TRACER.span("layout", width=self.viewport_width):
+            child.layout()
         self.height = child.height
+        self.child_needs_layout = False
+        if TRACER.enabled: TRACER.count("layout.blocks", self.recomputed)
+
+    def resize(self, width):
+        self.viewport_width = width
+
+    def invalidate(self, node):
+        # Marks the block that lays out `node` (or its nearest ancestor that
+        # has a block) as needing layout, e.g. after its style or children
+        # changed
+        blocks = {}
+        for block in tree_to_list(self, []):
+            blocks[id(block.node)] = block
+        while node is not None:
+            block = blocks.get(id(node))
+            if block is not None and block is not self:
+                block.mark_dirty()
+                return block
+            node = node.parent
+        return None
 
     def paint(self):
         return []
@@ -24,42 +59,145 @@ class DocumentLayout:
     def clear(self):
         self.children.clear()
 
+class IdTable:
+    # Gives each distinct value (a font, a color) a small integer id
+    def __init__(self):
+        self.values = []
+        self.ids = {}
+
+    def id_of(self, value):
+        i = self.ids.get(value)
+        if i is None:
+            i = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return i
+
+class LineBoxes:
+    # The positioned words of one block, stored as parallel arrays of x, y,
+    # font id and color id plus a word table, instead of a tuple per word.
+    # Font and color ids index the document's tables.
+    __slots__ = ("xs", "ys", "font_ids", "color_ids", "words",
+                 "fonts", "colors", "dy")
+
+    def __init__(self, fonts, colors):
+        self.xs = array("d")
+        self.ys = array("d")
+        self.font_ids = array("I")
+        self.color_ids = array("I")
+        self.words = []
+        self.fonts = fonts
+        self.colors = colors
+        self.dy = 0  # From shift(); added on the way out
+
+    def append(self, x, y, word, font, color):
+        self.xs.append(x)
+        self.ys.append(y)
+        self.font_ids.append(self.fonts.id_of(font))
+        self.color_ids.append(self.colors.id_of(color))
+        self.words.append(word)
+
+    def font(self, i):
+        return self.fonts.values[self.font_ids[i]]
+
+    def shift(self, dy):
+        self.dy += dy
+
+    def runs(self):
+        # Consecutive words with the same baseline, font and color were
+        # placed next to each other on one line, so each such stretch is
+        # one (x, y, text, font, color) run
+        xs, ys, words = self.xs, self.ys, self.words
+        font_ids, color_ids = self.font_ids, self.color_ids
+        start, n = 0, len(xs)
+        for i in range(1, n + 1):
+            if i < n and ys[i] == ys[start] and \
+               font_ids[i] == font_ids[start] and \
+               color_ids[i] == color_ids[start]:
+                continue
+            yield (xs[start], ys[start] + self.dy, " ".join(words[start:i]),
+                   self.fonts.values[font_ids[start]],
+                   self.colors.values[color_ids[start]])
+            start = i
+
+    def __iter__(self):
+        for i in range(len(self.xs)):
+            yield (self.xs[i], self.ys[i] + self.dy, self.words[i],
+                   self.font(i), self.colors.values[self.color_ids[i]])
+
+    def __len__(self):
+        return len(self.xs)
+
+NO_LINES = LineBoxes(IdTable(), IdTable())
+
 class BlockLayout:
     def __init__(self, node, parent, previous):
         self.node = node
         self.parent = parent
+        self.document = parent.document
         self.previous = previous
         self.children = []
+        self.toc_headers = {}
         self.x = None
         self.y = None
         self.width = None
         self.height = None
+        self.needs_layout = True
+        self.child_needs_layout = False
+        self.reset_inline_state()
+        self.is_centered = False
+
+    def reset_inline_state(self):
         self.cursor_x = 0
         self.cursor_y = 0
         self.weight = "normal"
         self.style = "roman"
         self.size = 12
-        self.display_list = []
-        self.line = []
-        self.is_centered = False
+        self.display_list = NO_LINES  # Replaced if the block is inline
+        self.line_start = 0  # First entry of the line being filled
         self.is_superscript = False
 
+    def mark_dirty(self):
+        self.needs_layout = True
+        parent = self.parent
+        while parent is not None and not parent.child_needs_layout:
+            parent.child_needs_layout = True
+            parent = parent.parent
+
     def layout(self):
         if self.previous:
-            self.y = self.previous.y + self.previous.height
+            y = self.previous.y + self.previous.height
         else:
-            self.y = self.parent.y
-        self.x = self.parent.x
-        self.width = self.parent.width
+            y = self.parent.y
+        x = self.parent.x
+        width = self.parent.width
 
+        if self.needs_layout or x != self.x or width != self.width:
+            self.x, self.y, self.width = x, y, width
+            self.layout_self()
+        elif self.child_needs_layout:
+            self.y = y
+            for child in self.children:
+                child.layout()
+            self.height = sum([child.height for child in self.children])
+        elif y != self.y:
+            self.shift(y - self.y)
+        self.needs_layout = False
+        self.child_needs_layout = False
+
+    def layout_self(self):
+        self.document.recomputed += 1
         self.is_centered = (isinstance(self.node, Element) and
                             self.node.tag == "h1" and
                             self.node.attributes.get("class") == "title")
         
+        self.reset_inline_state()
         mode = self.layout_mode()
         if mode == "block":
             self.layout_intermediate()
         else:
+            self.children = []
+            self.display_list = LineBoxes(self.document.fonts,
+                                          self.document.colors)
             self.adjust_layout_for_tag()
             self.recurse(self.node)
             self.flush()
@@ -72,6 +210,14 @@ class BlockLayout:
         else:
             self.height = self.cursor_y
 
+    def shift(self, dy):
+        # A clean block that only moved: keep its line boxes, move them
+        self.y += dy
+        if self.display_list:
+            self.display_list.shift(dy)
+        for child in self.children:
+            child.shift(dy)
+
     def word(self, node, word):
         weight = node.style["font-weight"]
         style = node.style["font-style"]
@@ -83,42 +229,41 @@ class BlockLayout:
         w = font.measure(word)
         if self.cursor_x + w > self.width:
             self.flush()
-        self.line.append((self.cursor_x, word, font, self.is_superscript, color))
+        # Until flush() places the line, x is relative and y holds the
+        # superscript flag
+        self.display_list.append(self.cursor_x, float(self.is_superscript),
+                                 word, font, color)
         self.cursor_x += w + font.measure(" ")
 
     def flush(self):
-        if not self.line: return
-        metrics = [font.metrics() for x, word, font, is_sup, color in self.line]
-        max_ascent = max([metric["ascent"] for metric in metrics])
+        lines = self.display_list
+        start, end = self.line_start, len(lines)
+        if start == end: return
+        fonts = [lines.fonts.values[i] for i in set(lines.font_ids[start:end])]
+        max_ascent = max([font.metrics("ascent") for font in fonts])
         baseline = self.cursor_y + 1.25 * max_ascent
 
         if self.is_centered:
-            line_width = sum([font.measure(word) for _, word, font, _,_  in self.line]) + \
-                         sum([font.measure(" ") for _, _, font, _, _ in self.line[:-1]])
+            line_width = lines.xs[end - 1] - lines.xs[start] + \
+                         lines.font(end - 1).measure(lines.words[end - 1])
             offset = (self.width - line_width) / 2
         else:
             offset = 0
 
-        for rel_x, word, font, is_sup, color in self.line:
-            x = self.x + rel_x + offset
-            if is_sup:
-                y = self.y + baseline - 1.5 * font.metrics("ascent")
+        for i in range(start, end):
+            ascent = lines.font(i).metrics("ascent")
+            lines.xs[i] = self.x + lines.xs[i] + offset
+            if lines.ys[i]:
+                lines.ys[i] = self.y + baseline - 1.5 * ascent
             else:
-                y = self.y + baseline - font.metrics("ascent")
-            self.display_list.append((x, y, word, font, color))
-        max_descent = max([metric["descent"] for metric in metrics])
+                lines.ys[i] = self.y + baseline - ascent
+        max_descent = max([font.metrics("descent") for font in fonts])
         self.cursor_y = baseline + 1.25 * max_descent        
         self.cursor_x = 0
-        self.line = []
+        self.line_start = end
 
     def get_font(self, size, weight, style):
-        key = (size, weight, style)
-        if key not in FONTS:
-            font = tkinter.font.Font(size=size, weight=weight,
-                slant=style)
-            label = tkinter.Label(font=font)
-            FONTS[key] = (font, label)
-        return FONTS[key][0]
+        return get_font(size, weight, style)
 
     def open_tag(self, tag):
         if tag == "i":
@@ -162,22 +307,39 @@ class BlockLayout:
             self.close_tag(node.tag)
 
     def layout_intermediate(self):
+        # Blocks for nodes we already laid out are reused, so clean
+        # children keep their cached layout
+        old = {}
+        for block in self.children:
+            old[id(block.node)] = block
+        toc_headers, self.toc_headers = self.toc_headers, {}
+        self.children = []
         previous = None
         children = self.node if isinstance(self.node, list) else self.node.children
         for child in children:
             if isinstance(child, Element) and child.tag == "head":
                 continue
             if isinstance(child, Element) and child.tag == "nav" and child.attributes.get("id") == "toc":
-                # Create a new Element for the "Table of Contents" header
-                toc_header = Element("div", {"class": "toc-header"}, self.node)
-                toc_header.children.append(Text("Table of Contents", toc_header))
-                
-                # Add the header as a new BlockLayout
-                header_layout = BlockLayout(toc_header, self, previous)
+                header_layout = toc_headers.get(id(child))
+                if header_layout is None:
+                    # Create a new Element for the "Table of Contents" header
+                    toc_header = Element("div", {"class": "toc-header"}, self.node)
+                    toc_header.children.append(Text("Table of Contents", toc_header))
+                    # It was never styled; use the nav's computed style
+                    toc_header.style = child.style
+                    toc_header.children[0].style = child.style
+
+                    # Add the header as a new BlockLayout
+                    header_layout = BlockLayout(toc_header, self, previous)
+                self.toc_headers[id(child)] = header_layout
+                header_layout.previous = previous
                 self.children.append(header_layout)
                 previous = header_layout
 
-            next_layout = BlockLayout(child, self, previous)
+            next_layout = old.get(id(child))
+            if next_layout is None:
+                next_layout = BlockLayout(child, self, previous)
+            next_layout.previous = previous
             self.children.append(next_layout)
             previous = next_layout
 
@@ -216,14 +378,12 @@ class BlockLayout:
         cmds = []
         bgcolor = self.node.style.get("background-color",
                                       "transparent")
-        print("bgColor ", bgcolor)
         if bgcolor != "transparent":
             x2, y2 = self.x + self.width, self.y + self.height
             rect = DrawRect(self.x, self.y, x2, y2, bgcolor)
             cmds.append(rect)
 
         if isinstance(self.node, Element):
-            print(self.node)
             if self.node.tag == "nav": 
                 if self.node.attributes.get("class") == "links":
                     x2, y2 = self.x + self.width, self.y + self.height
@@ -250,6 +410,10 @@ class BlockLayout:
                 cmds.append(rect)
 
         if self.layout_mode() == "inline":
-            for x, y, word, font, is_sup, color  in self.display_list:
-                cmds.append(DrawText(x, y, word, font, color))
+            linespace = {}
+            for x, y, text, font, color in self.display_list.runs():
+                if font not in linespace:
+                    linespace[font] = font.metrics("linespace")
+                cmds.append(DrawText(x, y, text, font, color,
+                                     linespace[font]))
         return cmds
\ No newline at end of file
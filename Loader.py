@@ -0,0 +1,108 @@
+import concurrent.futures
+import threading
+import time
+
+from CSSParser import CSSParser
+from Types import Element
+from utils import tree_to_list
+
+
+SUBRESOURCE_RELS = ["stylesheet", "prefetch"]
+
+class Subresource:
+    def __init__(self, rel, url):
+        self.rel = rel
+        self.url = url
+        self.body = None
+        self.rules = None  # Parsed rules, for stylesheets
+        self.error = None
+        self.wait_time = 0.0  # Blocked on the per-host limit
+        self.fetch_time = 0.0
+        self.parse_time = 0.0
+
+    def timings(self):
+        return {
+            "url": str(self.url),
+            "rel": self.rel,
+            "wait": self.wait_time,
+            "fetch": self.fetch_time,
+            "parse": self.parse_time,
+            "error": None if self.error is None else repr(self.error),
+        }
+
+def collect_subresources(base_url, tree):
+    # <link rel=stylesheet|prefetch href=...> in document order, one per URL
+    resources = []
+    seen = set()
+    for node in tree_to_list(tree, []):
+        if not isinstance(node, Element) or node.tag != "link": continue
+        href = node.attributes.get("href")
+        if not href: continue
+        rels = node.attributes.get("rel", "").casefold().split()
+        rel = next((r for r in SUBRESOURCE_RELS if r in rels), None)
+        if rel is None: continue
+        try:
+            url = base_url.resolve(href)
+        except Exception as e:
+            # Only this link fails; it's reported with the others
+            resource = Subresource(rel, href)
+            resource.error = e
+            resources.append(resource)
+            continue
+        if str(url) in seen: continue
+        seen.add(str(url))
+        resources.append(Subresource(rel, url))
+    return resources
+
+class SubresourceLoader:
+    # Fetches a page's subresources on a bounded thread pool, with at most
+    # per_host requests in flight to any one host. Page load then waits
+    # for the slowest fetch rather than the sum of them.
+    def __init__(self, max_workers=8, per_host=4):
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.host_limits = {}
+        self.lock = threading.Lock()
+
+    def host_limit(self, url):
+        key = (url.scheme, url.host, url.port)
+        with self.lock:
+            if key not in self.host_limits:
+                self.host_limits[key] = threading.BoundedSemaphore(
+                    self.per_host)
+            return self.host_limits[key]
+
+    def fetch(self, resource):
+        limit = self.host_limit(resource.url)
+        start = time.perf_counter()
+        with limit:
+            fetch_start = time.perf_counter()
+            resource.wait_time = fetch_start - start
+            try:
+                resource.body = resource.url.request()
+            except Exception as e:
+                resource.error = e
+            resource.fetch_time = time.perf_counter() - fetch_start
+        if resource.rel == "stylesheet" and resource.body is not None:
+            parse_start = time.perf_counter()
+            resource.rules = CSSParser(resource.body).parse()
+            resource.parse_time = time.perf_counter() - parse_start
+        return resource
+
+    def load(self, base_url, tree):
+        resources = collect_subresources(base_url, tree)
+        pending = [resource for resource in resources if resource.error is None]
+        if not pending:
+            return resources
+        workers = min(self.max_workers, len(pending))
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            list(pool.map(self.fetch, pending))
+        return resources
+
+def style_sheet_rules(resources):
+    # Rules from every fetched stylesheet, in document order
+    rules = []
+    for resource in resources:
+        if resource.rules:
+            rules.extend(resource.rules)
+    return rules
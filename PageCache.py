@@ -0,0 +1,233 @@
+import collections
+import os
+import time
+
+from Draw import DisplayList
+from Globals import WIDTH
+from HTMLParser import HTMLParser
+from Layout import DocumentLayout
+from Types import Text
+from URL import URL
+from utils import paint_tree, style, tree_to_list
+
+
+# Rough per-object sizes (bytes, CPython 3.11, measured with tracemalloc)
+# used to charge pages against the cache budget
+ELEMENT_BYTES = 180
+ATTRIBUTE_BYTES = 100
+TEXT_NODE_BYTES = 110
+BLOCK_BYTES = 560
+WORD_BYTES = 85
+COMMAND_BYTES = 230
+
+def current_validators(url):
+    # What identifies the version of `url` we'd get now, without touching
+    # the network: the HTTP cache entry's validators and body hash, or a
+    # file's mtime and size. None means the page can't be validated.
+    u = URL(url)
+    if u.scheme == "file":
+        try:
+            stat = os.stat(u.file_path)
+        except OSError:
+            return None
+        return ("file", stat.st_mtime_ns, stat.st_size)
+    if u.scheme == "http" or u.scheme == "https":
+        meta = URL.http_cache.metadata(str(u))
+        if meta is None:
+            return None
+        return ("http", meta.get("etag"), meta.get("last_modified"),
+                meta["hash"])
+    return (u.scheme,)  # data: and about:blank never change
+
+def estimate_bytes(page):
+    size = 0
+    for node in tree_to_list(page.tree, []):
+        if isinstance(node, Text):
+            size += TEXT_NODE_BYTES + len(node.text)
+        else:
+            size += ELEMENT_BYTES + ATTRIBUTE_BYTES * len(node.attributes)
+    for block in tree_to_list(page.document, []):
+        size += BLOCK_BYTES + \
+            WORD_BYTES * len(getattr(block, "display_list", ()))
+    for cmd in page.display_list:
+        size += COMMAND_BYTES + len(getattr(cmd, "text", ""))
+    return size
+
+class Page:
+    # A loaded page: DOM, layout tree and display list. `source` is the
+    # URL the body actually came from (after redirects); `validators` are
+    # current_validators(source) at load time.
+    def __init__(self, url, source, tree, document, display_list, validators):
+        self.url = url
+        self.source = source
+        self.tree = tree
+        self.document = document
+        self.display_list = display_list
+        self.validators = validators
+        self.scroll = 0
+        self.size = estimate_bytes(self)
+        self.timings = {}
+
+def load_page(url, width=WIDTH, body=None, source=None):
+    timings = {}
+    start = time.perf_counter()
+    if body is None:
+        u = URL(url)
+        body = u.request()
+        source = str(u)
+    timings["fetch"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tree = HTMLParser(body).parse()
+    style(tree)
+    document = DocumentLayout(tree, width)
+    document.layout()
+    display_list = []
+    paint_tree(document, display_list)
+    timings["render"] = time.perf_counter() - start
+
+    source = source or url
+    page = Page(url, source, tree, document, DisplayList(display_list),
+                current_validators(source))
+    page.timings = timings
+    return page
+
+class PageCache:
+    # Recently visited pages kept whole, so back/forward and reload can
+    # skip fetching, parsing, styling, layout and paint. Least recently
+    # used pages are dropped once the estimated size passes max_bytes.
+    def __init__(self, max_bytes=128 << 20):
+        self.max_bytes = max_bytes
+        self.pages = collections.OrderedDict()  # url -> Page
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.evictions = 0
+
+    def get(self, url):
+        # The cached page, if what it was built from hasn't changed since
+        page = self.pages.get(url)
+        if page is None:
+            self.misses += 1
+            return None
+        if page.validators is None or \
+           current_validators(page.source) != page.validators:
+            self.remove(url)
+            self.invalidated += 1
+            return None
+        self.pages.move_to_end(url)
+        self.hits += 1
+        return page
+
+    def put(self, page):
+        self.remove(page.url)
+        if page.validators is None or page.size > self.max_bytes:
+            return  # Could never be restored, or would evict everything
+        self.pages[page.url] = page
+        self.size += page.size
+        while self.size > self.max_bytes:
+            _, evicted = self.pages.popitem(last=False)
+            self.size -= evicted.size
+            self.evictions += 1
+
+    def remove(self, url):
+        page = self.pages.pop(url, None)
+        if page is not None:
+            self.size -= page.size
+
+    def clear(self):
+        self.pages.clear()
+        self.size = 0
+
+    def stats(self):
+        return {
+            "pages": len(self.pages),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidated": self.invalidated,
+            "evictions": self.evictions,
+        }
+
+class History:
+    # Back/forward list of URLs; visiting a new page drops the forward part
+    def __init__(self):
+        self.entries = []
+        self.index = -1
+
+    def visit(self, url):
+        del self.entries[self.index + 1:]
+        self.entries.append(url)
+        self.index += 1
+
+    def can_go_back(self):
+        return self.index > 0
+
+    def can_go_forward(self):
+        return self.index + 1 < len(self.entries)
+
+    def back(self):
+        assert self.can_go_back()
+        self.index -= 1
+        return self.entries[self.index]
+
+    def forward(self):
+        assert self.can_go_forward()
+        self.index += 1
+        return self.entries[self.index]
+
+    def current(self):
+        return self.entries[self.index] if self.index >= 0 else None
+
+class Navigator:
+    # Ties History and PageCache together. navigate() always loads the
+    # page; back(), forward() and reload() restore the cached page when
+    # its validators still match.
+    def __init__(self, cache=None, width=WIDTH):
+        self.history = History()
+        self.cache = cache if cache is not None else PageCache()
+        self.width = width
+        self.page = None
+
+    def navigate(self, url):
+        self.history.visit(url)
+        return self.show(load_page(url, self.width))
+
+    def back(self):
+        return self.restore(self.history.back())
+
+    def forward(self):
+        return self.restore(self.history.forward())
+
+    def reload(self):
+        # Fetching goes through the HTTP cache, so this is at most a
+        # conditional request; a 304 leaves the validators unchanged
+        url = self.history.current()
+        u = URL(url)
+        if u.scheme == "http" or u.scheme == "https":
+            body = u.request()
+            page = self.cache.get(url)
+            if page is None:
+                page = load_page(url, self.width, body, str(u))
+            return self.show(page)
+        return self.restore(url)
+
+    def restore(self, url):
+        page = self.cache.get(url)
+        if page is None:
+            page = load_page(url, self.width)
+        return self.show(page)
+
+    def show(self, page):
+        if page.document.viewport_width != self.width:
+            page.document.resize(self.width)
+            page.document.layout()
+            display_list = []
+            paint_tree(page.document, display_list)
+            page.display_list = DisplayList(display_list)
+            page.size = estimate_bytes(page)
+        self.cache.put(page)
+        self.page = page
+        return page
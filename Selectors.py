@@ -4,20 +4,66 @@ from Types import Element
 class TagSelector:
     def __init__(self, tag):
         self.tag = tag
+        self.tags = (tag,)
         self.priority = 1
 
-    def matches(self, node):
+    def matches(self, node, ancestors=None):
         return isinstance(node, Element) and self.tag == node.tag
     
 class DescendantSelector:
     def __init__(self, ancestor, descendant):
         self.ancestor = ancestor
         self.descendant = descendant
+        self.tags = ancestor.tags + descendant.tags
+        # Tags that must all appear somewhere above a matching node
+        self.ancestor_tags = frozenset(ancestor.tags)
         self.priority = ancestor.priority + descendant.priority
 
-    def matches(self, node):
+    def matches(self, node, ancestors=None):
         if not self.descendant.matches(node): return False
+        if ancestors is not None:
+            if not ancestors.may_contain_all(self.ancestor_tags):
+                ancestors.skipped += 1
+                return False
+            ancestors.walks += 1
         while node.parent:
             if self.ancestor.matches(node.parent): return True
             node = node.parent
         return False
+
+class AncestorFilter:
+    # Counting bloom filter over the tags of the elements above the node
+    # being styled. A miss means no ancestor has that tag, so the
+    # DescendantSelector walk up the tree can be skipped; a hit may be a
+    # false positive and still needs the walk.
+    def __init__(self, parent=None, size=1024):
+        self.counts = [0] * size
+        self.mask = size - 1
+        self.skipped = 0
+        self.walks = 0
+        while parent:
+            if isinstance(parent, Element):
+                self.push(parent.tag)
+            parent = parent.parent
+
+    def slots(self, tag):
+        h = hash(tag)
+        return h & self.mask, (h >> 16) & self.mask
+
+    def push(self, tag):
+        a, b = self.slots(tag)
+        self.counts[a] += 1
+        self.counts[b] += 1
+
+    def pop(self, tag):
+        a, b = self.slots(tag)
+        self.counts[a] -= 1
+        self.counts[b] -= 1
+
+    def may_contain_all(self, tags):
+        counts = self.counts
+        for tag in tags:
+            a, b = self.slots(tag)
+            if not (counts[a] and counts[b]):
+                return False
+        return True
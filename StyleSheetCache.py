@@ -0,0 +1,75 @@
+import hashlib
+import json
+import os
+
+from CSSParser import CSSParser
+from Selectors import DescendantSelector, TagSelector
+
+
+# Bump when the parser or the serialized layout changes meaning
+CACHE_VERSION = 1
+
+def cache_file(path, cache_dir):
+    name = hashlib.sha1(path.encode("utf8")).hexdigest() + ".json"
+    return os.path.join(cache_dir, "stylesheets", name)
+
+def dump_rules(rules):
+    return [[list(selector.tags), body] for selector, body in rules]
+
+def load_rules(data):
+    rules = []
+    for tags, body in data:
+        selector = TagSelector(tags[0])
+        for tag in tags[1:]:
+            selector = DescendantSelector(selector, TagSelector(tag))
+        rules.append((selector, body))
+    return rules
+
+def read_entry(filename):
+    try:
+        with open(filename, encoding="utf8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(entry, dict) or entry.get("version") != CACHE_VERSION:
+        return None
+    return entry
+
+def write_entry(filename, entry):
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp = "{}.{}.tmp".format(filename, os.getpid())
+        with open(tmp, "w", encoding="utf8") as f:
+            json.dump(entry, f)
+        os.replace(tmp, filename)
+    except OSError:
+        pass  # A read-only cache only costs us a re-parse next time
+
+def load_style_sheet(path, cache_dir):
+    # Parsed rules are cached on disk keyed by path, mtime and content
+    # hash; an unchanged file is never re-read, a touched-but-identical
+    # one is re-hashed but not re-parsed.
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    filename = cache_file(path, cache_dir)
+    entry = read_entry(filename)
+    if entry and entry["path"] == path and \
+       entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+        return load_rules(entry["rules"])
+
+    with open(path, "rb") as f:
+        source = f.read()
+    digest = hashlib.sha256(source).hexdigest()
+    if entry and entry["path"] == path and entry["hash"] == digest:
+        rules = load_rules(entry["rules"])
+    else:
+        rules = CSSParser(source.decode("utf8")).parse()
+    write_entry(filename, {
+        "version": CACHE_VERSION,
+        "path": path,
+        "mtime": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "hash": digest,
+        "rules": dump_rules(rules),
+    })
+    return rules
@@ -0,0 +1,128 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+
+class NullSpan:
+    # Returned by span() while tracing is off, so a traced block costs one
+    # call and an attribute check
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class Span:
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        self.tracer.complete(self.name, self.start, end, self.args)
+        return False
+
+class Tracer:
+    # Named spans, counters and samplers, exported in the Chrome trace event
+    # format (chrome://tracing, Perfetto). Hot code checks `enabled` before
+    # counting, so nothing is recorded or computed while it is off.
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.counters = {}
+        self.samplers = {}
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter_ns()
+        self.pid = os.getpid()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.events = []
+            self.counters = {}
+            self.origin = time.perf_counter_ns()
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, args)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def instant(self, name, **args):
+        if self.enabled:
+            self.event(name, "i", time.perf_counter_ns(), args, s="t")
+
+    def add_sampler(self, name, fn):
+        # fn() returns a dict; its numeric values are recorded as a counter
+        # track after every span
+        self.samplers[name] = fn
+
+    def remove_sampler(self, name):
+        self.samplers.pop(name, None)
+
+    def sample(self):
+        now = time.perf_counter_ns()
+        for name, fn in list(self.samplers.items()):
+            values = {key: value for key, value in fn().items()
+                      if isinstance(value, (int, float))
+                      and not isinstance(value, bool)}
+            self.event(name, "C", now, values)
+
+    def complete(self, name, start, end, args):
+        self.event(name, "X", start, args, dur=(end - start) / 1000)
+        if self.samplers:
+            self.sample()
+
+    def event(self, name, phase, ns, args, **fields):
+        event = {
+            "name": name,
+            "ph": phase,
+            "ts": (ns - self.origin) / 1000,
+            "pid": self.pid,
+            "tid": threading.get_ident(),
+            "args": args,
+        }
+        event.update(fields)
+        with self.lock:
+            self.events.append(event)
+
+    def trace_events(self):
+        # Counter totals go last, as one counter track each
+        now = (time.perf_counter_ns() - self.origin) / 1000
+        with self.lock:
+            events = list(self.events)
+            counters = dict(self.counters)
+        for name, value in sorted(counters.items()):
+            events.append({"name": name, "ph": "C", "ts": now,
+                           "pid": self.pid, "tid": 0,
+                           "args": {"value": value}})
+        return events
+
+    def export(self, path):
+        with open(path, "w", encoding="utf8") as f:
+            json.dump({"traceEvents": self.trace_events(),
+                       "displayTimeUnit": "ms"}, f)
+
+TRACER = Tracer()
+
+# BROWSER_TRACE=<file> turns tracing on and writes the trace on exit
+if os.environ.get("BROWSER_TRACE"):
+    TRACER.enable()
+    atexit.register(TRACER.export, os.environ["BROWSER_TRACE"])
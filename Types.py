@@ -1,20 +1,33 @@
+import sys
+from types import MappingProxyType
+
+# Shared by every node that has nothing of its own, so an empty value costs
+# a pointer rather than a fresh list or dict per node
+EMPTY_CHILDREN = ()
+EMPTY_ATTRIBUTES = MappingProxyType({})
+EMPTY_STYLE = MappingProxyType({})
+
 class Text:
+    __slots__ = ("text", "style", "parent")
+    children = EMPTY_CHILDREN  # Text never has children
+
     def __init__(self, text, parent):
         self.text = text
-        self.style = {}
-        self.children = []
+        self.style = EMPTY_STYLE
         self.parent = parent
 
     def __repr__(self):
         return repr(self.text)
 
 class Element:
+    __slots__ = ("tag", "style", "children", "parent", "attributes")
+
     def __init__(self, tag, attributes, parent):
-        self.tag = tag
-        self.style = {}
+        self.tag = sys.intern(tag)
+        self.style = EMPTY_STYLE
         self.children = []
         self.parent = parent
-        self.attributes = attributes
+        self.attributes = attributes if attributes else EMPTY_ATTRIBUTES
 
     def __repr__(self):
-        return "<" + self.tag + ">"
\ No newline at end of file
+        return "<" + self.tag + ">"
@@ -1,9 +1,52 @@
-import gzip
-import socket
-import ssl
+import codecs
+import collections
+import mmap
+import os
+import zlib
 
+from ConnectionPool import POOL
+from HTTPCache import HTTP_CACHE
+from Trace import TRACER
+
+
+FILE_CHUNK_SIZE = 1 << 20
+
+class FileCache:
+    # Decoded text of recently opened local files, valid while the file's
+    # mtime and size are unchanged; bounded by total characters
+    def __init__(self, max_bytes=64 << 20, max_file_bytes=8 << 20):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, stat):
+        entry = self.entries.get(path)
+        if entry and entry[0] == (stat.st_mtime_ns, stat.st_size):
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def put(self, path, stat, text):
+        old = self.entries.pop(path, None)
+        if old:
+            self.size -= len(old[1])
+        self.entries[path] = ((stat.st_mtime_ns, stat.st_size), text)
+        self.size += len(text)
+        while self.size > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+FILE_CACHE = FileCache()
 
 class URL:
+    pool = POOL  # Shared keep-alive connections; swap out in tests
+    http_cache = HTTP_CACHE  # Shared response cache, keyed by str(url)
+
     def __init__(self, url):
         self.scheme = None
         self.host = None
@@ -18,7 +61,7 @@ class URL:
             if url.startswith("view-source:"):
                 self.view_source_mode = True
                 url = url[len("view-source:"):]
-                print(url)
+                TRACER.instant("view-source", url=url)
 
             # Handle about:blank
             if url == "about:blank":
@@ -53,75 +96,252 @@ class URL:
             self.is_blank = True
 
         self.s = {}
-        self.cache = {}  # Store URLs and responses
+
+    def __str__(self):
+        if self.is_blank:
+            return "about:blank"
+        if self.scheme == "file":
+            return "file://" + self.file_path
+        if self.scheme == "data":
+            return "data:" + self.data_url
+        return "{}://{}:{}{}".format(self.scheme, self.host, self.port,
+                                     self.path)
 
     def request(self):
         if self.is_blank:
             return ""  # Return empty content for about:blank or malformed URLs
         
+        with TRACER.span("fetch", url=str(self)):
+            if self.scheme == "http" or self.scheme == "https":
+                return self.handle_http()
+            elif self.scheme == "file":
+                return self.handle_file()
+            elif self.scheme == "data":
+                return self.handle_data()
+
+    def stream(self, chunk_size=8192):
+        # Yields the body in pieces as it arrives, e.g. for HTMLParser.feed
+        if self.is_blank:
+            return
         if self.scheme == "http" or self.scheme == "https":
-            return self.handle_http()
+            yield from self.stream_http(chunk_size)
         elif self.scheme == "file":
-            return self.handle_file()
-        elif self.scheme == "data":
-            return self.handle_data()
-        
+            yield from self.stream_file(chunk_size)
+        else:
+            content = self.request()
+            if content:
+                yield content
+
     def handle_http(self):
-        if self.path in self.cache:
-            return self.cache[self.path]
+        return "".join(self.stream_http())
 
-        self.s = socket.socket(family=socket.AF_INET, type=socket.SOCK_STREAM )
-        if self.scheme == "https":
-            ctx = ssl.create_default_context()
-            self.s = ctx.wrap_socket(self.s, server_hostname=self.host)
-        self.s.connect((self.host, self.port))
+    def stream_http(self, chunk_size=8192):
+        url = str(self)
+        cached = self.http_cache.lookup(url)
+        if cached and cached[2]:  # Still fresh: no network at all
+            yield cached[1]
+            return
 
-        request = "GET {} HTTP/1.0\r\n".format(self.path)  # Keep-alive uses HTTP 1.1
+        request = "GET {} HTTP/1.1\r\n".format(self.path)
         request += "Host: {}\r\n".format(self.host)
-        # request += "Connection: keep-alive\r\n"  # Add keep-alive header
+        request += "Connection: keep-alive\r\n"
+        request += "Accept-Encoding: gzip, deflate\r\n"
+        if cached:  # Stale: ask the server whether our copy is still good
+            for header, value in self.http_cache.validators(cached[0]).items():
+                request += "{}: {}\r\n".format(header, value)
         request += "\r\n"
-        self.s.send(request.encode("utf8"))
-        response = self.s.makefile("r", encoding="utf8", newline="\r\n")
-
-        statusline = response.readline()
-        version, status, explanation = statusline.split(" ", 2)
-        if status.startswith("3"):  # Redirect handling
-            for line in response:
-                if line.startswith("Location:"):
-                    location = line.split(" ", 1)[1].strip()
-                    if location.startswith("/"):
-                        location = "{}://{}{}".format(self.scheme, self.host, location)
-                    self.__init__(location)
-                    return self.request()  # Recursive redirect
-        
+        fresh = False
+        while True:
+            conn = self.pool.acquire(self.scheme, self.host, self.port, fresh)
+            try:
+                conn.sock.sendall(request.encode("utf8"))
+                statusline = conn.file.readline()
+            except OSError:
+                statusline = b""
+            if statusline or not conn.reused: break
+            # The server dropped this idle connection (and probably the
+            # other idle ones); retry once on a newly opened socket
+            conn.close()
+            self.pool.discard_idle(self.scheme, self.host, self.port)
+            fresh = True
+        if not statusline:
+            conn.close()
+            raise ConnectionError("No response from {}".format(self.host))
+
+        version, status, explanation = \
+            statusline.decode("latin-1").split(" ", 2)
         response_headers = {}
         while True:
-            line = response.readline()
-            if line == "\r\n": break
-            header, value = line.split(":", 1)
+            line = conn.file.readline()
+            if line in (b"\r\n", b"\n", b""): break
+            header, value = line.decode("latin-1").split(":", 1)
             response_headers[header.casefold()] = value.strip()
 
-        assert "transfer-encoding" not in response_headers
-        assert "content-encoding" not in response_headers
+        reusable = False
+        try:
+            if status == "304" and cached:
+                reusable = self.keeps_alive(version, response_headers)
+                self.pool.release(conn, reusable)
+                self.http_cache.refresh(url, response_headers)
+                yield cached[1]
+                return
+
+            if status.startswith("3") and "location" in response_headers:
+                for _ in self.read_body(conn, status, response_headers,
+                                        chunk_size):
+                    pass
+                reusable = self.keeps_alive(version, response_headers)
+                self.pool.release(conn, reusable)
+                location = response_headers["location"]
+                if location.startswith("/"):
+                    location = "{}://{}:{}{}".format(
+                        self.scheme, self.host, self.port, location)
+                self.__init__(location)
+                yield from self.stream(chunk_size)  # Recursive redirect
+                return
+
+            decoder = codecs.getincrementaldecoder(
+                self.charset(response_headers))(errors="replace")
+            body = self.read_body(conn, status, response_headers, chunk_size)
+            chunks = []
+            for data in self.decompress(body, response_headers):
+                chunk = decoder.decode(data)
+                if chunk:
+                    chunks.append(chunk)
+                    yield chunk
+            chunk = decoder.decode(b"", final=True)
+            if chunk:
+                chunks.append(chunk)
+                yield chunk
+            if status == "200":
+                self.http_cache.store(url, response_headers, "".join(chunks))
+            reusable = self.keeps_alive(version, response_headers) and \
+                ("content-length" in response_headers or
+                 self.is_chunked(response_headers))
+            self.pool.release(conn, reusable)
+        finally:
+            if not reusable:
+                conn.close()
+
+    def read_body(self, conn, status, headers, chunk_size):
+        # Chunked and Content-Length framing let the connection be reused;
+        # without either the body runs to EOF
+        if status in ("204", "304") or status.startswith("1"):
+            return
+        if self.is_chunked(headers):
+            while True:
+                line = conn.file.readline()
+                if not line:
+                    raise ConnectionError("Connection closed mid-response")
+                size = int(line.split(b";", 1)[0].strip(), 16)
+                if size == 0: break
+                yield from self.read_exactly(conn, size, chunk_size)
+                conn.file.readline()  # CRLF after the chunk data
+            while conn.file.readline() not in (b"\r\n", b"\n", b""):
+                pass  # Trailer headers
+        elif "content-length" in headers:
+            yield from self.read_exactly(
+                conn, int(headers["content-length"]), chunk_size)
+        else:
+            while True:
+                data = conn.file.read1(chunk_size)
+                if not data: break
+                yield data
 
-        content = response.read()
-        if "content-encoding" in response_headers and response_headers["content-encoding"] == "gzip":
-            content = gzip.decompress(content)
-        self.cache[self.path] = content        
-        self.s.close()
-        return content
+    def read_exactly(self, conn, remaining, chunk_size):
+        while remaining > 0:
+            data = conn.file.read1(min(chunk_size, remaining))
+            if not data:
+                raise ConnectionError("Connection closed mid-response")
+            remaining -= len(data)
+            yield data
+
+    def is_chunked(self, headers):
+        return "chunked" in headers.get("transfer-encoding", "").casefold()
+
+    def decompress(self, body, headers):
+        encoding = headers.get("content-encoding", "identity").casefold()
+        if encoding in ("gzip", "x-gzip"):
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            decompressor = zlib.decompressobj()
+        else:
+            yield from body
+            return
+        first = True
+        for data in body:
+            try:
+                out = decompressor.decompress(data)
+            except zlib.error:
+                if encoding != "deflate" or not first: raise
+                # Some servers send raw deflate without the zlib header
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                out = decompressor.decompress(data)
+            first = False
+            if out:
+                yield out
+        out = decompressor.flush()
+        if out:
+            yield out
+
+    def charset(self, headers):
+        for param in headers.get("content-type", "").split(";")[1:]:
+            key, _, value = param.partition("=")
+            if key.strip().casefold() == "charset":
+                charset = value.strip().strip("\"'")
+                try:
+                    return codecs.lookup(charset).name
+                except LookupError:
+                    break
+        return "utf8"
+
+    def keeps_alive(self, version, headers):
+        connection = headers.get("connection", "").casefold()
+        if version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
 
 
     def handle_file(self):
+        return "".join(self.stream_file(FILE_CHUNK_SIZE))
+
+    def stream_file(self, chunk_size=8192):
+        # The file is mapped rather than read, and decoded a chunk at a
+        # time, so a big file is never held as both bytes and text.
+        # Small files are kept decoded, keyed by mtime and size.
+        path = self.file_path
         try:
-            with open(self.path, "r", encoding="utf8") as f:
-                return f.read()
+            stat = os.stat(path)
         except FileNotFoundError:
-            return "File not found: " + self.path
+            yield "File not found: " + path
+            return
+        text = FILE_CACHE.get(path, stat)
+        if text is not None:
+            yield text
+            return
+        if stat.st_size == 0:
+            return  # mmap can't map an empty file
+
+        cacheable = stat.st_size <= FILE_CACHE.max_file_bytes
+        chunks = []
+        decoder = codecs.getincrementaldecoder("utf8")(errors="replace")
+        with open(path, "rb") as f, \
+             mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for start in range(0, len(data), chunk_size):
+                chunk = decoder.decode(data[start:start + chunk_size])
+                if chunk:
+                    if cacheable: chunks.append(chunk)
+                    yield chunk
+        chunk = decoder.decode(b"", final=True)
+        if chunk:
+            if cacheable: chunks.append(chunk)
+            yield chunk
+        if cacheable:
+            FILE_CACHE.put(path, stat, "".join(chunks))
 
     def handle_data(self):
-        if self.path.startswith("text/html,"):
-            return self.path.split(",", 1)[1]  # Inline HTML content
+        if self.data_url.startswith("text/html,"):
+            return self.data_url.split(",", 1)[1]  # Inline HTML content
         return "Unsupported data type"
 
     def handle_view_source(self):
@@ -129,13 +349,17 @@ class URL:
     
     def resolve(self, url):
         if "://" in url: return URL(url)
+        path = self.file_path if self.scheme == "file" else self.path
+        assert path is not None, "Can't resolve a relative URL against " + str(self)
         if not url.startswith("/"):
-            dir, _ = self.path.rsplit("/", 1)
+            dir, _ = path.rsplit("/", 1)
             while url.startswith("../"):
                 _, url = url.split("/", 1)
                 if "/" in dir:
                     dir, _ = dir.rsplit("/", 1)
             url = dir + "/" + url
+        if self.scheme == "file":
+            return URL("file://" + url)
         if url.startswith("//"):
             return URL(self.scheme + ":" + url)
         else:
@@ -0,0 +1,151 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+
+import Fonts
+from Draw import DrawRect, DrawText
+from Globals import WIDTH
+from HTMLParser import HTMLParser
+from HTTPCache import HTTPCache
+from Layout import DocumentLayout
+from URL import URL
+from utils import paint_tree, style, tree_to_list
+
+
+def read_manifest(path):
+    # One URL or file path per line; blank lines and # comments are skipped.
+    # Bare paths become file:// URLs.
+    urls = []
+    with open(path, encoding="utf8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if "://" not in line and not line.startswith(("data:", "about:")):
+                line = "file://" + os.path.abspath(line)
+            urls.append(line)
+    return urls
+
+def serialize(cmd):
+    if isinstance(cmd, DrawText):
+        return {"type": "text", "left": cmd.left, "top": cmd.top,
+                "bottom": cmd.bottom, "text": cmd.text,
+                "font": list(cmd.font.key), "color": cmd.color}
+    if isinstance(cmd, DrawRect):
+        return {"type": "rect", "left": cmd.left, "top": cmd.top,
+                "right": cmd.right, "bottom": cmd.bottom, "color": cmd.color}
+    raise ValueError("Unknown draw command: " + type(cmd).__name__)
+
+# Set in each worker by init_worker
+width = WIDTH
+output_dir = None
+
+def init_worker(page_width, directory):
+    global width, output_dir
+    Fonts.set_backend("headless")
+    # The on-disk cache index isn't safe to share between processes (each
+    # rewrites it from its own copy), so every worker gets a memory-only one
+    URL.http_cache = HTTPCache(None)
+    width = page_width
+    output_dir = directory
+
+def render(job):
+    index, url = job
+    result = {"index": index, "url": url}
+    timings = result["timings"] = {}
+    try:
+        start = time.perf_counter()
+        u = URL(url)
+        if u.scheme == "file" and not os.path.isfile(u.file_path):
+            # URL.request would hand back a "File not found" page instead
+            raise FileNotFoundError(u.file_path)
+        body = u.request()
+        timings["fetch"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        tree = HTMLParser(body).parse()
+        timings["parse"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        style(tree)
+        timings["style"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        document = DocumentLayout(tree, width)
+        document.layout()
+        timings["layout"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        display_list = []
+        paint_tree(document, display_list)
+        timings["paint"] = time.perf_counter() - start
+    except Exception as e:
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+        return result
+
+    result["nodes"] = len(tree_to_list(tree, []))
+    result["commands"] = len(display_list)
+    result["height"] = document.height
+    if output_dir:
+        result["output"] = "{:06d}.json".format(index)
+        with open(os.path.join(output_dir, result["output"]), "w",
+                  encoding="utf8") as f:
+            json.dump({"url": url, "width": width, "height": document.height,
+                       "display_list": [serialize(cmd) for cmd in display_list]},
+                      f)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render a list of pages headlessly across processes")
+    parser.add_argument("manifest", help="file with one URL or path per line")
+    parser.add_argument("--output", help="directory for display lists and "
+                                         "timings.json")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="worker processes (default: one per core)")
+    parser.add_argument("--chunksize", type=int, default=4,
+                        help="pages handed to a worker at a time")
+    parser.add_argument("--width", type=int, default=WIDTH)
+    args = parser.parse_args()
+
+    urls = read_manifest(args.manifest)
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    start = time.perf_counter()
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=args.workers, initializer=init_worker,
+            initargs=(args.width, args.output)) as pool:
+        for result in pool.map(render, enumerate(urls),
+                               chunksize=args.chunksize):
+            results.append(result)
+            if "error" in result:
+                print("{}: {}".format(result["url"], result["error"]),
+                      file=sys.stderr)
+    elapsed = time.perf_counter() - start
+
+    failed = sum(1 for result in results if "error" in result)
+    summary = {
+        "pages": len(results),
+        "failed": failed,
+        "workers": args.workers,
+        "seconds": elapsed,
+        "pages_per_second": len(results) / elapsed if elapsed else 0,
+        "results": results,
+    }
+    if args.output:
+        with open(os.path.join(args.output, "timings.json"), "w",
+                  encoding="utf8") as f:
+            json.dump(summary, f, indent=2)
+    print("{} pages ({} failed) in {:.2f}s, {:.1f} pages/s with {} workers"
+          .format(len(results), failed, elapsed, summary["pages_per_second"],
+                  args.workers), file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
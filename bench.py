@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import Fonts
+from bench_css import generate_style_sheet
+from CSSParser import CSSParser
+from Globals import default_style_sheet
+from HTMLParser import HTMLParser
+from Layout import DocumentLayout
+from utils import paint_tree, style, tree_to_list
+
+
+STAGES = ["parse", "style", "layout", "paint"]
+
+# Synthetic pages run when no custom case or fixture is given
+CASES = [
+    {"name": "small", "nodes": 1000, "depth": 4, "inline_style": 0.05, "rules": 0},
+    {"name": "large", "nodes": 20000, "depth": 4, "inline_style": 0.05, "rules": 0},
+    {"name": "deep", "nodes": 5000, "depth": 40, "inline_style": 0.05, "rules": 0},
+    {"name": "styled", "nodes": 5000, "depth": 6, "inline_style": 0.5, "rules": 500},
+]
+
+INLINE_TAGS = ["b", "i", "a", "small", "big"]
+INLINE_STYLES = ["color:red", "font-size:120%", "font-weight:bold",
+                 "font-style:italic", "background-color:#eeeeee"]
+WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur",
+         "adipiscing", "elit", "sed", "do", "eiusmod", "tempor"]
+
+def generate_page(nodes, depth, inline_style, seed=0):
+    # Roughly `nodes` DOM nodes: runs of nested divs (up to `depth` deep)
+    # around a paragraph of text and inline tags. `inline_style` is the
+    # share of elements that get a style attribute.
+    rng = random.Random(seed)
+
+    def open_tag(tag):
+        if rng.random() < inline_style:
+            return '<{} style="{}">'.format(tag, rng.choice(INLINE_STYLES))
+        return "<" + tag + ">"
+
+    out = ["<html><body>"]
+    count = 2
+    while count < nodes:
+        levels = rng.randint(1, depth)
+        out.extend(open_tag("div") for _ in range(levels))
+        out.append(open_tag("p"))
+        count += levels + 1
+        for _ in range(rng.randint(1, 6)):
+            out.append(" ".join(rng.sample(WORDS, 4)) + " ")
+            tag = rng.choice(INLINE_TAGS)
+            out.append(open_tag(tag) + rng.choice(WORDS) + "</" + tag + "> ")
+            count += 3
+        out.append("</p>" + "</div>" * levels)
+    out.append("</body></html>")
+    return "".join(out)
+
+def timed(fn, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def traced(fn):
+    # Peak bytes allocated while fn runs; objects from earlier stages are
+    # not counted
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run_case(name, body, rules, repeat):
+    def parse():
+        return HTMLParser(body).parse()
+
+    def layout():
+        document = DocumentLayout(tree)
+        document.layout()
+        return document
+
+    def paint():
+        display_list = []
+        paint_tree(document, display_list)
+        return display_list
+
+    stages = {}
+    stages["parse"], tree = timed(parse, repeat)
+    stages["style"], _ = timed(lambda: style(tree, rules), repeat)
+    stages["layout"], document = timed(layout, repeat)
+    stages["paint"], display_list = timed(paint, repeat)
+
+    peaks = {
+        "parse": traced(parse),
+        "style": traced(lambda: style(tree, rules)),
+        "layout": traced(layout),
+        "paint": traced(paint),
+    }
+
+    return {
+        "name": name,
+        "bytes": len(body),
+        "nodes": {
+            "dom": len(tree_to_list(tree, [])),
+            "layout": len(tree_to_list(document, [])),
+            "display_list": len(display_list),
+        },
+        "stages": {stage: {"seconds": stages[stage], "peak_bytes": peaks[stage]}
+                   for stage in STAGES},
+        "total_seconds": sum(stages.values()),
+    }
+
+def compare(results, baseline, threshold, memory_threshold, min_seconds):
+    # Lists every stage that got slower (or used more memory) than the
+    # baseline by more than the threshold; cases missing from either side
+    # are skipped
+    previous = {case["name"]: case for case in baseline["cases"]}
+    regressions = []
+    for case in results["cases"]:
+        old = previous.get(case["name"])
+        if old is None:
+            continue
+        for stage in STAGES:
+            new_stage, old_stage = case["stages"][stage], old["stages"][stage]
+            seconds, old_seconds = new_stage["seconds"], old_stage["seconds"]
+            if seconds > old_seconds * (1 + threshold) and \
+               seconds - old_seconds > min_seconds:
+                regressions.append("{} {}: {:.2f}ms -> {:.2f}ms (+{:.0%})".format(
+                    case["name"], stage, old_seconds * 1000, seconds * 1000,
+                    seconds / old_seconds - 1))
+            peak, old_peak = new_stage["peak_bytes"], old_stage["peak_bytes"]
+            if old_peak and peak > old_peak * (1 + memory_threshold):
+                regressions.append("{} {}: peak {} -> {} bytes (+{:.0%})".format(
+                    case["name"], stage, old_peak, peak, peak / old_peak - 1))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time parse, style, layout and paint on synthetic and "
+                    "captured pages")
+    parser.add_argument("--nodes", type=int,
+                        help="run one synthetic case of this size instead of "
+                             "the built-in cases")
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--inline-style", type=float, default=0.05,
+                        help="share of elements with a style attribute")
+    parser.add_argument("--rules", type=int, default=0,
+                        help="extra generated rules on top of browser.css")
+    parser.add_argument("--fixture", action="append", default=[],
+                        help="captured HTML page to benchmark (repeatable)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--baseline",
+                        help="earlier report to compare against; exits 1 on "
+                             "a regression")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed slowdown per stage (0.25 = 25%%)")
+    parser.add_argument("--memory-threshold", type=float, default=0.10,
+                        help="allowed peak memory growth per stage")
+    parser.add_argument("--min-seconds", type=float, default=0.002,
+                        help="ignore slowdowns smaller than this")
+    args = parser.parse_args()
+
+    Fonts.set_backend("headless")  # Layout needs no display and is repeatable
+
+    if args.nodes:
+        cases = [{"name": "custom", "nodes": args.nodes, "depth": args.depth,
+                  "inline_style": args.inline_style, "rules": args.rules}]
+    elif args.fixture:
+        cases = []
+    else:
+        cases = CASES
+
+    jobs = []
+    for case in cases:
+        body = generate_page(case["nodes"], case["depth"],
+                             case["inline_style"], args.seed)
+        jobs.append((case["name"], body, case["rules"], case))
+    for path in args.fixture:
+        with open(path, encoding="utf8") as f:
+            jobs.append((os.path.basename(path), f.read(), args.rules,
+                         {"fixture": path}))
+
+    results = {
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "cases": [],
+    }
+    for name, body, extra_rules, params in jobs:
+        rules = default_style_sheet()
+        if extra_rules:
+            rules = rules + CSSParser(
+                generate_style_sheet(extra_rules, args.seed)).parse()
+        case = run_case(name, body, rules, args.repeat)
+        case["params"] = params
+        results["cases"].append(case)
+        print("{:>12}: ".format(name) + "  ".join(
+            "{} {:.1f}ms".format(stage, case["stages"][stage]["seconds"] * 1000)
+            for stage in STAGES), file=sys.stderr)
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold,
+                              args.memory_threshold, args.min_seconds)
+        for regression in regressions:
+            print("regression: " + regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import argparse
+import gc
+import random
+import time
+
+from CSSParser import CSSParser
+
+
+TAGS = ["a", "b", "i", "p", "div", "span", "nav", "ul", "li", "h1", "pre"]
+DECLARATIONS = [
+    "color: blue", "font-size: 90%", "font-style: italic",
+    "font-weight: bold", "background-color: #f0f0f0", "margin: 0",
+    "font-family: Times New Roman",  # Multi-word value, hits error recovery
+]
+
+def generate_style_sheet(rules, seed=0):
+    rng = random.Random(seed)
+    out = []
+    for _ in range(rules):
+        selector = " ".join(rng.choice(TAGS) for _ in range(rng.randint(1, 4)))
+        body = "; ".join(rng.sample(DECLARATIONS, rng.randint(1, 4)))
+        out.append("{} {{ {}; }}".format(selector, body))
+    return "\n".join(out)
+
+def same_rules(a, b):
+    return [(s.tags, body) for s, body in a] == \
+           [(s.tags, body) for s, body in b]
+
+def time_engine(s, engine, repeat):
+    best = None
+    gc.disable()  # Both engines allocate the same selectors; keep GC noise out
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rules = CSSParser(s, engine=engine).parse()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        gc.enable()
+    return best, rules
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the legacy and fast CSSParser engines")
+    parser.add_argument("--rules", type=int, nargs="+",
+                        default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--file", help="benchmark a real stylesheet instead")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, encoding="utf8") as f:
+            sheets = [(args.file, f.read())]
+    else:
+        sheets = [("{} rules".format(n), generate_style_sheet(n))
+                  for n in args.rules]
+
+    print("{:>16} {:>10} {:>12} {:>12} {:>8}".format(
+        "stylesheet", "bytes", "legacy (ms)", "fast (ms)", "speedup"))
+    for name, s in sheets:
+        legacy, legacy_rules = time_engine(s, "legacy", args.repeat)
+        fast, fast_rules = time_engine(s, "fast", args.repeat)
+        assert same_rules(legacy_rules, fast_rules), "engines disagree"
+        print("{:>16} {:>10} {:>12.2f} {:>12.2f} {:>7.1f}x".format(
+            name, len(s), legacy * 1000, fast * 1000, legacy / fast))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import gc
+import random
+import tracemalloc
+
+import HTMLParser as html_parser
+from HTMLParser import HTMLParser
+from Types import Element, Text
+from utils import tree_to_list
+
+
+# The node classes as they were before __slots__, kept here as the baseline
+class DictText:
+    def __init__(self, text, parent):
+        self.text = text
+        self.style = {}
+        self.children = []
+        self.parent = parent
+
+class DictElement:
+    def __init__(self, tag, attributes, parent):
+        self.tag = tag
+        self.style = {}
+        self.children = []
+        self.parent = parent
+        self.attributes = attributes
+
+TAGS = ["p", "div", "span", "b", "i", "a", "li"]
+ATTRIBUTES = ['class="note"', 'id="x{}"', 'href="/page{}"',
+              'style="color: blue"']
+
+def generate_html(nodes, seed=0):
+    rng = random.Random(seed)
+    out = ["<html><body>"]
+    for i in range(nodes // 2):
+        tag = rng.choice(TAGS)
+        attributes = ""
+        if rng.random() < 0.3:
+            attributes = " " + rng.choice(ATTRIBUTES).format(i)
+        out.append("<{}{}>word {}</{}>".format(tag, attributes, i, tag))
+    out.append("</body></html>")
+    return "".join(out)
+
+def measure(body, element_class, text_class):
+    # Swaps the classes HTMLParser instantiates, so both variants go through
+    # the same parser and only the node representation differs
+    saved = html_parser.Element, html_parser.Text
+    html_parser.Element, html_parser.Text = element_class, text_class
+    gc.collect()
+    tracemalloc.start()
+    try:
+        tree = HTMLParser(body).parse()
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+        html_parser.Element, html_parser.Text = saved
+    return used, len(tree_to_list(tree, []))
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare DOM memory of dict-based and __slots__ nodes")
+    parser.add_argument("--nodes", type=int, nargs="+",
+                        default=[10000, 100000])
+    parser.add_argument("--file", help="measure a real page instead")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, encoding="utf8") as f:
+            pages = [(args.file, f.read())]
+    else:
+        pages = [("{} nodes".format(n), generate_html(n))
+                 for n in args.nodes]
+
+    print("{:>16} {:>8} {:>14} {:>14} {:>8}".format(
+        "page", "nodes", "dict (B/node)", "slots (B/node)", "saving"))
+    for name, body in pages:
+        before, count = measure(body, DictElement, DictText)
+        after, _ = measure(body, Element, Text)
+        print("{:>16} {:>8} {:>14.1f} {:>14.1f} {:>7.1f}x".format(
+            name, count, before / count, after / count, before / after))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import gzip
+import http.server
+import shutil
+import tempfile
+import threading
+import unittest
+
+from ConnectionPool import ConnectionPool
+from HTTPCache import HTTPCache
+from URL import URL
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    # Local stand-in server; counts connections and 304s on the server
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, body, **headers):
+        data = body.encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        for header, value in headers.items():
+            self.send_header(header.replace("_", "-"), value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/hello":
+            self.send_body("hello " + self.path)
+        elif self.path == "/drop":
+            # Looks reusable to the client, but the server hangs up
+            self.send_body("dropped")
+            self.close_connection = True
+        elif self.path == "/chunked-gzip":
+            data = gzip.compress(("gzip body " * 500).encode("utf8"))
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.send_header("Content-Encoding", "gzip")
+            self.end_headers()
+            for start in range(0, len(data), 100):
+                chunk = data[start:start + 100]
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+        elif self.path == "/etag":
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.server.not_modified += 1
+                self.send_response(304)
+                self.send_header("ETag", '"v1"')
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+            else:
+                self.send_body("versioned", ETag='"v1"',
+                               Cache_Control="no-cache")
+        else:
+            self.send_error(404)
+
+class HTTPTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        cls.server.daemon_threads = True
+        cls.thread = threading.Thread(target=cls.server.serve_forever,
+                                      daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.connections = 0
+        self.server.not_modified = 0
+        self.cache_dir = tempfile.mkdtemp()
+        self.saved = URL.pool, URL.http_cache
+        URL.pool = ConnectionPool()
+        URL.http_cache = HTTPCache(self.cache_dir)
+
+    def tearDown(self):
+        URL.pool.close_all()
+        URL.pool, URL.http_cache = self.saved
+        shutil.rmtree(self.cache_dir)
+
+    def url(self, path):
+        return URL("http://127.0.0.1:{}{}".format(
+            self.server.server_address[1], path))
+
+    def test_keep_alive_reuse(self):
+        self.assertEqual(self.url("/hello").request(), "hello /hello")
+        self.assertEqual(self.url("/hello").request(), "hello /hello")
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(URL.pool.stats()["hits"], 1)
+
+    def test_retry_after_server_closed_idle_socket(self):
+        self.assertEqual(self.url("/drop").request(), "dropped")
+        self.assertEqual(URL.pool.stats()["idle"], 1)
+        self.assertEqual(self.url("/hello").request(), "hello /hello")
+        # The dead idle socket was tried first, then a fresh one
+        self.assertEqual(URL.pool.stats()["hits"], 1)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_retry_when_every_idle_socket_is_stale(self):
+        # Several sockets left idle, all since closed by the server, as
+        # after parallel subresource fetches to a server with a short
+        # keep-alive timeout
+        address = ("http",) + self.server.server_address
+        for _ in range(3):
+            conn = URL.pool.acquire(*address, fresh=True)
+            conn.sock.sendall(b"GET /drop HTTP/1.1\r\nHost: x\r\n\r\n")
+            while conn.file.readline() not in (b"\r\n", b""):
+                pass
+            self.assertEqual(conn.file.read(len("dropped")), b"dropped")
+            URL.pool.release(conn, True)
+        self.assertEqual(URL.pool.stats()["idle"], 3)
+        self.assertEqual(self.url("/hello").request(), "hello /hello")
+        # One stale socket was tried, the rest dropped, then a fresh one
+        self.assertEqual(self.server.connections, 4)
+        self.assertEqual(URL.pool.stats()["idle"], 1)
+
+    def test_chunked_gzip_body(self):
+        self.assertEqual(self.url("/chunked-gzip").request(),
+                         "gzip body " * 500)
+        # Chunked framing ends the body, so the socket goes back to the pool
+        self.assertEqual(URL.pool.stats()["idle"], 1)
+
+    def test_304_revalidation(self):
+        self.assertEqual(self.url("/etag").request(), "versioned")
+        self.assertEqual(self.url("/etag").request(), "versioned")
+        self.assertEqual(self.server.not_modified, 1)
+        self.assertEqual(URL.http_cache.stats()["revalidations"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
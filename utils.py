@@ -1,9 +1,23 @@
+import functools
+from types import MappingProxyType
+
 from CSSParser import CSSParser
-from Globals import INHERITED_PROPERTIES
+from Globals import INHERITED_PROPERTIES, default_style_sheet
+from Selectors import AncestorFilter, DescendantSelector, TagSelector
+from Trace import TRACER
 from Types import Element
 
 
 def paint_tree(layout_object, display_list):
+    if TRACER.enabled and layout_object.parent is None:
+        with TRACER.span("paint"):
+            start = len(display_list)
+            paint_children(layout_object, display_list)
+        TRACER.count("paint.commands", len(display_list) - start)
+    else:
+        paint_children(layout_object, display_list)
+
+def paint_children(layout_object, display_list):
      # Get the commands from the current layout object
     layout_commands = layout_object.paint()
     
@@ -13,41 +27,109 @@ def paint_tree(layout_object, display_list):
     # display_list.extend(layout_object.paint())
 
     for child in layout_object.children:
-        paint_tree(child, display_list)
+        paint_children(child, display_list)
 
-def style(node, rules):
-    node.style = {}
+def style(node, rules=None, ancestors=None, cache=None):
+    if rules is None:
+        rules = default_style_sheet()
+    if not isinstance(rules, RuleSet):
+        rules = RuleSet(rules)
+    if ancestors is None:
+        ancestors = AncestorFilter(node.parent)
+    if cache is None:
+        cache = StyleCache()
+        if TRACER.enabled:
+            with TRACER.span("style", rules=len(rules)):
+                style(node, rules, ancestors, cache)
+            TRACER.count("style.cache_hits", cache.hits)
+            TRACER.count("style.cache_misses", cache.misses)
+            return
 
-    
+    parent_style = node.parent.style if node.parent else None
+    candidates = rules.candidates(node)
+    if candidates:
+        matched = tuple(i for i, (selector, body) in enumerate(candidates)
+                        if selector.matches(node, ancestors))
+        if TRACER.enabled: TRACER.count("style.rules_tested", len(candidates))
+    else:
+        matched = ()
+    is_element = isinstance(node, Element)
+    if is_element:
+        tag, inline = node.tag, node.attributes.get("style")
+    else:
+        tag, inline = None, None
 
+    key = (id(parent_style), tag, inline, matched)
+    node.style = cache.get(key)
+    if node.style is None:
+        bodies = [candidates[i][1] for i in matched]
+        node.style = cache.put(key, parent_style,
+                               compute_style(parent_style, bodies, inline))
+
+    if is_element:
+        ancestors.push(tag)
+    for child in node.children:
+        style(child, rules, ancestors, cache)
+    if is_element:
+        ancestors.pop(tag)
+
+def compute_style(parent_style, bodies, inline):
+    computed = {}
     for property, default_value in INHERITED_PROPERTIES.items():
-        if node.parent:
-            node.style[property] = node.parent.style[property]
+        if parent_style is not None:
+            computed[property] = parent_style[property]
         else:
-            node.style[property] = default_value
+            computed[property] = default_value
 
-    for selector, body in rules:
-        if not selector.matches(node): continue
+    for body in bodies:
         for property, value in body.items():
-            node.style[property] = value
+            computed[property] = value
 
-    if isinstance(node, Element) and "style" in node.attributes:
-        pairs = CSSParser(node.attributes["style"]).body()
-        for property, value in pairs.items():
-            node.style[property] = value
+    if inline is not None:
+        for property, value in parse_inline_style(inline).items():
+            computed[property] = value
 
-    if node.style["font-size"].endswith("%"):
-        if node.parent:
-            parent_font_size = node.parent.style["font-size"]
+    if computed["font-size"].endswith("%"):
+        if parent_style is not None:
+            parent_font_size = parent_style["font-size"]
         else:
             parent_font_size = INHERITED_PROPERTIES["font-size"]
-        node_pct = float(node.style["font-size"][:-1]) / 100
-        parent_px = float(parent_font_size[:-2])
-        node.style["font-size"] = str(node_pct * parent_px) + "px"
-    
+        computed["font-size"] = font_size_px(computed["font-size"],
+                                             parent_font_size)
+    return MappingProxyType(computed)
 
-    for child in node.children:
-        style(child, rules)
+# Pages tend to repeat a handful of style="..." strings; hit/miss counts
+# are available from parse_inline_style.cache_info()
+@functools.lru_cache(maxsize=1024)
+def parse_inline_style(s):
+    return MappingProxyType(CSSParser(s).body())
+
+@functools.lru_cache(maxsize=1024)
+def font_size_px(percentage, parent_font_size):
+    node_pct = float(percentage[:-1]) / 100
+    parent_px = float(parent_font_size[:-2])
+    return str(node_pct * parent_px) + "px"
+
+class StyleCache:
+    # Shares one read-only computed style between nodes whose style can't
+    # differ: same parent style object, tag, inline style and matched rules.
+    # Entries keep the parent style alive so its id() can't be reused.
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, parent_style, computed):
+        self.entries[key] = (parent_style, computed)
+        return computed
 
 def tree_to_list(tree, list):
     list.append(tree)
@@ -62,4 +144,42 @@ def print_tree(node, indent=0):
 
 def cascade_priority(rule):
     selector, body = rule
-    return selector.priority
\ No newline at end of file
+    return selector.priority
+
+def rightmost_tag(selector):
+    while isinstance(selector, DescendantSelector):
+        selector = selector.descendant
+    if isinstance(selector, TagSelector):
+        return selector.tag
+    return None
+
+class RuleSet:
+    # Rules bucketed by the tag of their rightmost selector, so a node is
+    # only tested against rules that could match it. Every bucket keeps the
+    # cascade order of the sorted rule list.
+    def __init__(self, rules):
+        self.rules = sorted(rules, key=cascade_priority)
+        self.by_tag = {}
+        self.untagged = []
+        for index, (selector, body) in enumerate(self.rules):
+            tag = rightmost_tag(selector)
+            if tag is None:
+                self.untagged.append((index, selector, body))
+            else:
+                self.by_tag.setdefault(tag, []).append((index, selector, body))
+        self.merged = {}
+
+    def candidates(self, node):
+        tag = node.tag if isinstance(node, Element) else None
+        if tag not in self.merged:
+            tagged = self.by_tag.get(tag, []) if tag is not None else []
+            ordered = sorted(tagged + self.untagged, key=lambda rule: rule[0])
+            self.merged[tag] = [(selector, body)
+                                for _, selector, body in ordered]
+        return self.merged[tag]
+
+    def __iter__(self):
+        return iter(self.rules)
+
+    def __len__(self):
+        return len(self.rules)